@@ -0,0 +1,326 @@
+'''Archive of test runs, with an index for fast queries across runs.
+
+Run metadata (load, duration, date, calibration, specimen) and summary
+statistics (mean, drift rate) are kept in an SQLite index. Each run's samples
+are cached as a columnar NumPy array (row 0 times in s, row 1 values) in
+`<archive>/data/<id>.npy`, so neither queries nor loading samples need the
+raw text files again.
+
+Existing captures (one value per line, metadata in the filename, eg.
+"930g after calibration over 3min") are imported with `import_file` or
+`import_directory`. Leftover readings at the start of a capture (eg. from
+taring) are found by their jump in value and left out of the statistics.
+Anything not known from a file is stored as NULL rather than guessed: the
+date of an imported run is unknown, and times spread evenly over the
+duration in the name are marked with `times_estimated`.
+>>> archive = RunArchive('runs')
+>>> archive.import_directory('..')
+>>> [(run['name'], run['drift_rate']) for run in archive.query(load=930)]
+'''
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    source TEXT UNIQUE,
+    load REAL,
+    duration REAL,
+    date TEXT,
+    calibrated INTEGER NOT NULL,
+    specimen TEXT,
+    units TEXT NOT NULL,
+    samples INTEGER NOT NULL,
+    spacing REAL,
+    times_estimated INTEGER NOT NULL,
+    skipped INTEGER NOT NULL,
+    discontinuities INTEGER NOT NULL,
+    mean REAL,
+    std REAL,
+    drift_rate REAL
+);
+CREATE INDEX IF NOT EXISTS runs_load ON runs (load);
+CREATE INDEX IF NOT EXISTS runs_specimen ON runs (specimen);
+'''
+
+# columns that can be filtered on with `RunArchive.query`
+QUERY_COLUMNS = ('name', 'load', 'date', 'calibrated', 'specimen', 'units', 'times_estimated')
+# a step between samples this many times the median step is a discontinuity
+JUMP_FACTOR = 50
+# discontinuities in this fraction of a run at its start are leftover readings
+LEADING_FRACTION = 0.1
+
+
+def parse_name(name):
+    '''Find metadata from the name of a capture file
+
+    Args:
+        name (str): file name, eg. "930g after calibration over 3min"
+    Returns:
+        dict: load (g, 0 for "nothing", None if unknown), duration (s, None if unknown)
+            and calibrated (bool)
+    Examples:
+    >>> parse_name('930g after calibration over 3min')
+    {'load': 930.0, 'duration': 180.0, 'calibrated': True}
+    >>> parse_name('nothing over 5 min')
+    {'load': 0.0, 'duration': 300.0, 'calibrated': False}
+    '''
+    lower_name = name.lower()
+    load = re.search(r'(\d+(?:\.\d+)?)\s*g\b', lower_name)
+    if load is not None:
+        load = float(load.group(1))
+    elif lower_name.startswith('nothing'):
+        load = 0.0
+    duration = re.search(r'(\d+(?:\.\d+)?)\s*min', lower_name)
+    if duration is not None:
+        duration = 60 * float(duration.group(1))
+    return {'load': load, 'duration': duration, 'calibrated': 'after calibration' in lower_name}
+
+
+def read_values(path):
+    '''Read a capture file of one value per line, ignoring blank lines
+
+    Raises:
+        ValueError: if any line is not a number
+    Returns:
+        numpy.ndarray: values
+    '''
+    with open(path) as capture:
+        return np.array([float(line) for line in capture if line.strip()])
+
+
+def find_jumps(values, factor=JUMP_FACTOR):
+    '''Find discontinuities, where a sample jumps from the one before
+
+    Args:
+        values (numpy.ndarray): sample values
+    Kwargs:
+        factor (float): smallest jump, as a multiple of the median step
+    Returns:
+        numpy.ndarray: index of the sample after each jump
+    Examples:
+    >>> find_jumps(np.array([85, -89, 881203, 881511, 881371, 881620]))
+    array([2])
+    '''
+    steps = np.abs(np.diff(values))
+    if len(steps) == 0:
+        return np.array([], dtype=int)
+    return np.flatnonzero(steps > factor * np.median(steps)) + 1
+
+
+def leading_samples(values):
+    '''Number of leftover samples at the start of a run, before its first
+    discontinuity within LEADING_FRACTION of the start
+    '''
+    jumps = find_jumps(values)
+    leading = jumps[jumps <= LEADING_FRACTION * len(values)]
+    return int(leading[-1]) if len(leading) else 0
+
+
+def drift_rate(times, values):
+    '''Gradient of linear regression of `values` against `times`, per minute
+    '''
+    if len(values) < 2 or np.all(np.isnan(times)):
+        return None
+    return float(np.polyfit(times, values, 1)[0] * 60)
+
+
+class RunArchive:
+    '''Index and cache of test runs, stored in `directory`.
+
+    Args:
+        directory (str): directory for the index and cached samples, made if needed
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.data_directory = os.path.join(directory, 'data')
+        os.makedirs(self.data_directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def data_path(self, run_id):
+        return os.path.join(self.data_directory, f'{run_id}.npy')
+
+    def add_run(self, values, name, times=None, spacing=None, load=None, duration=None,
+                date=None, calibrated=False, specimen=None, units=None, source=None,
+                skip=None):
+        '''Add a run to the archive
+
+        Times are taken from `times` if given, otherwise from `spacing`, otherwise
+        estimated by spreading samples evenly over `duration` (spacing is then
+        stored as NULL and times_estimated set). If none are given, times are NaN.
+
+        All samples are cached, but the first `skip` are left out of mean, std
+        and drift_rate. drift_rate is NULL if there are discontinuities (see
+        `find_jumps`) in the samples used, as a fit across them is meaningless.
+
+        Args:
+            values (array-like): sample values
+            name (str): name of run
+        Kwargs:
+            times (array-like): time of each sample (s)
+            spacing (float): time between samples (s)
+            load (float): load applied (g), 0 for none
+            duration (float): length of run (s)
+            date (str): ISO date and time of run, None if unknown
+            calibrated (bool): whether values are calibrated (not raw readings)
+            specimen (str): name of specimen tested
+            units (str): units of values, defaults to 'g' if calibrated else 'counts'
+            source (str): file run was imported from, must be unique
+            skip (int): leftover samples at the start, found with
+                `leading_samples` by default
+        Returns:
+            int: id of run
+        '''
+        values = np.asarray(values, dtype=float)
+        times_estimated = False
+        if times is not None:
+            times = np.asarray(times, dtype=float)
+            if times.shape != values.shape:
+                raise ValueError('times and values must be the same length')
+            if len(times) > 1:
+                spacing = float(np.mean(np.diff(times)))
+        elif spacing is not None:
+            times = np.arange(len(values)) * spacing
+        elif duration is not None and len(values):
+            times = np.arange(len(values)) * (duration / len(values))
+            times_estimated = True
+        else:
+            times = np.full(len(values), np.nan)
+        if duration is None and spacing is not None:
+            duration = spacing * len(values)
+        if units is None:
+            units = 'g' if calibrated else 'counts'
+        if skip is None:
+            skip = leading_samples(values)
+        if not 0 <= skip <= len(values):
+            raise ValueError(f'skip must be between 0 and {len(values)}, not {skip}')
+
+        used = values[skip:]
+        discontinuities = len(find_jumps(used))
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (name, source, load, duration, date, calibrated, specimen, '
+                'units, samples, spacing, times_estimated, skipped, discontinuities, '
+                'mean, std, drift_rate) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (name, source, load, duration, date, int(calibrated), specimen, units,
+                 len(values), spacing, int(times_estimated), skip, discontinuities,
+                 float(np.mean(used)) if len(used) else None,
+                 float(np.std(used)) if len(used) else None,
+                 None if discontinuities else drift_rate(times[skip:], used)))
+            run_id = cursor.lastrowid
+            np.save(self.data_path(run_id), np.vstack((times, values)))
+        return run_id
+
+    def import_file(self, path, replace=False, **metadata):
+        '''Import a capture file, with metadata from its name
+
+        The date is left unknown, as the file's modification time is usually
+        when it was copied rather than when it was captured.
+
+        Args:
+            path (str): capture file, one value per line
+        Kwargs:
+            replace (bool): re-import if already imported, otherwise existing id is returned
+            metadata: overrides metadata found from file name (see `add_run`)
+        Returns:
+            int: id of run
+        '''
+        source = os.path.abspath(path)
+        existing = self.connection.execute('SELECT id FROM runs WHERE source = ?',
+                                           (source,)).fetchone()
+        if existing is not None:
+            if not replace:
+                return existing['id']
+            self.remove(existing['id'])
+
+        name = os.path.basename(path)
+        found = parse_name(name)
+        found.update(metadata)
+        return self.add_run(read_values(path), name, source=source, **found)
+
+    def import_directory(self, directory, replace=False):
+        '''Import every capture file in `directory`
+
+        Files with an extension, or with any line that isn't a number, are skipped.
+
+        Returns:
+            list[int]: ids of runs
+        '''
+        run_ids = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path) or os.path.splitext(name)[1]:
+                continue
+            try:
+                run_ids.append(self.import_file(path, replace=replace))
+            except (ValueError, UnicodeDecodeError):
+                continue
+        return run_ids
+
+    def remove(self, run_id):
+        '''Remove a run and its cached samples
+        '''
+        with self.connection:
+            self.connection.execute('DELETE FROM runs WHERE id = ?', (run_id,))
+        if os.path.exists(self.data_path(run_id)):
+            os.remove(self.data_path(run_id))
+
+    def query(self, order_by='date', min_duration=None, max_duration=None, **filters):
+        '''Find runs from the index
+
+        Kwargs:
+            order_by (str): column to sort by
+            min_duration (float): shortest run to include (s)
+            max_duration (float): longest run to include (s)
+            filters: column=value pairs runs must match, columns from QUERY_COLUMNS
+        Returns:
+            list[dict]: index row of each run
+        Examples:
+        >>> archive.query(load=930, calibrated=False)
+        '''
+        conditions = []
+        parameters = []
+        for column, value in filters.items():
+            if column not in QUERY_COLUMNS:
+                raise ValueError(f'Can not filter on {column}, use one of {QUERY_COLUMNS}')
+            if value is None:
+                conditions.append(f'{column} IS NULL')
+            else:
+                conditions.append(f'{column} = ?')
+                parameters.append(int(value) if isinstance(value, bool) else value)
+        if min_duration is not None:
+            conditions.append('duration >= ?')
+            parameters.append(min_duration)
+        if max_duration is not None:
+            conditions.append('duration <= ?')
+            parameters.append(max_duration)
+        if order_by not in QUERY_COLUMNS + ('id', 'duration', 'samples', 'skipped',
+                                            'discontinuities', 'mean', 'std', 'drift_rate'):
+            raise ValueError(f'Can not order by {order_by}')
+
+        sql = 'SELECT * FROM runs'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += f' ORDER BY {order_by}, id'
+        return [dict(row) for row in self.connection.execute(sql, parameters)]
+
+    def samples(self, run_id, mmap=True):
+        '''Load cached samples of a run
+
+        Kwargs:
+            mmap (bool): memory map the cache rather than reading it all in
+        Returns:
+            tuple: (times (s), values), as numpy.ndarray
+        '''
+        data = np.load(self.data_path(run_id), mmap_mode='r' if mmap else None)
+        return data[0], data[1]
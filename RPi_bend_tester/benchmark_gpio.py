@@ -0,0 +1,94 @@
+'''Compare HX711 bit-banging throughput of the RPi.GPIO and GpioMem backends.
+
+Samples are read through HX711.readRawBytes, so the timing includes the
+driver's own overhead (pulse timing, byte packing, read lock).
+
+Each sample waits for a real conversion, so a run takes about
+samples / 80 s per backend (samples / 10 s with the RATE pin low):
+    python benchmark_gpio.py [samples]
+
+Run on a Raspberry Pi to map `/dev/gpiomem`. Elsewhere, a stand-in file is
+mapped instead and RPi.GPIO is skipped if it is not installed.
+'''
+import argparse
+import os
+from tempfile import gettempdir
+from time import perf_counter
+
+from gpiomem import GpioMem, make_stand_in
+from hx711 import HX711
+
+# pin for dout (input pin) -> 5
+# pin for pd_sck (output pin) -> 6
+DOUT = 5
+PD_SCK = 6
+# number of samples read per backend, 2.5 s at 80 Hz
+SAMPLES = 200
+
+
+def time_samples(gpio, samples=SAMPLES, timeout=1):
+    '''Time reading `samples` samples with HX711.readRawBytes
+
+    Only clocking each word out is timed, not waiting for the HX711 to be
+    ready, so the result is the bit-banging cost of a sample rather than the
+    HX711's data rate.
+
+    Args:
+        gpio: GPIO backend (RPi.GPIO module or GpioMem)
+    Kwargs:
+        samples (int): number of samples to read
+        timeout (float): longest wait for the HX711 to be ready (s)
+    Returns:
+        tuple: (seconds per sample, bits clocked per sample, invalid reads retried)
+    '''
+    hx = HX711(DOUT, PD_SCK, gpio=gpio)
+    hx.reset()
+    total = 0
+    for _ in range(samples):
+        end = perf_counter() + timeout
+        while not hx.is_ready():
+            if perf_counter() > end:
+                raise RuntimeError(f'HX711 not ready after {timeout} s, check DOUT and PD_SCK')
+        start = perf_counter()
+        hx.readRawBytes()
+        total += perf_counter() - start
+    return total / samples, 24 + hx.GAIN, hx.invalidReads
+
+
+def report(name, sample_time, bits, invalid_reads):
+    print(f'{name:>8}: {sample_time / bits * 1e6:.2f} us/bit, '
+          f'{sample_time * 1e6:.1f} us/sample, '
+          f'{1 / sample_time:.0f} samples/s max, '
+          f'{invalid_reads} invalid reads retried')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare HX711 GPIO backends.')
+    parser.add_argument('samples', nargs='?', type=int, default=SAMPLES,
+                        help=f'samples read per backend (default {SAMPLES})')
+    samples = parser.parse_args().samples
+    if samples < 1:
+        parser.error(f'samples must be at least 1, not {samples}')
+    results = {}
+
+    try:
+        import RPi.GPIO as GPIO
+    except ImportError:
+        print('RPi.GPIO not installed, skipping')
+    else:
+        results['RPi.GPIO'] = time_samples(GPIO, samples)
+        GPIO.cleanup()
+
+    if os.path.exists('/dev/gpiomem'):
+        path = '/dev/gpiomem'
+    else:
+        path = make_stand_in(os.path.join(gettempdir(), 'gpiomem_stand_in'))
+        print(f'/dev/gpiomem not found, using stand-in {path}')
+    gpio = GpioMem(path)
+    results['GpioMem'] = time_samples(gpio, samples)
+    gpio.cleanup()
+
+    for name, result in results.items():
+        report(name, *result)
+    if len(results) == 2:
+        print(f'GpioMem speedup: {results["RPi.GPIO"][0] / results["GpioMem"][0]:.1f}x')
@@ -0,0 +1,416 @@
+'''Streaming digital filters for load cell samples.
+
+Each stage keeps a constant amount of state, so `update` costs the same for
+every sample and can be used on the live stream from `HX711.read_long`.
+`process` is the batch form, for reprocessing logged runs with NumPy.
+Both forms share state, so a batch can carry on from where a stream left off
+(and vice versa), and give the same values.
+
+The batch forms of the IIR and Kalman stages use scipy.signal.lfilter if
+scipy is installed (pip install scipy). Without it they fall back to looping
+over `update` in Python, which costs around a microsecond per sample per
+stage rather than a few nanoseconds.
+
+Stages are chained with `Pipeline`, eg. for the HX711 at 80 Hz:
+>>> pipeline = Pipeline(Biquad.notch(50, 80),
+...                     SinglePoleLowPass(10, 80),
+...                     Decimate(4))
+'''
+from collections import deque
+from math import cos, exp, pi, sin
+
+import numpy as np
+
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
+
+class Stage:
+    '''Base class for a filter stage.
+
+    Subclasses must implement `update`, `process` and `reset`.
+    '''
+    def update(self, value):
+        '''Filter a single sample.
+
+        Args:
+            value (float): next raw sample
+        Returns:
+            float/None: filtered sample, or None if no sample is output
+        '''
+        raise NotImplementedError
+
+    def process(self, values):
+        '''Filter an array of samples, continuing from the current state.
+
+        Args:
+            values (array-like): raw samples, oldest first
+        Returns:
+            numpy.ndarray: filtered samples
+        '''
+        raise NotImplementedError
+
+    def reset(self):
+        '''Forget all previous samples.
+        '''
+        raise NotImplementedError
+
+
+class MovingAverage(Stage):
+    '''Mean of the last `window` samples.
+
+    Fewer samples are averaged until `window` samples have been seen.
+    '''
+    def __init__(self, window):
+        if not isinstance(window, int):
+            raise TypeError(f'window must be an int, not {type(window)}')
+        if window < 1:
+            raise ValueError(f'window must be at least 1, not {window}')
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.history = deque(maxlen=self.window)
+        self.total = 0.0
+
+    def update(self, value):
+        if len(self.history) == self.window:
+            self.total -= self.history[0]
+        self.history.append(value)
+        self.total += value
+        return self.total / len(self.history)
+
+    def process(self, values):
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return values
+        # prepend history so the first outputs average over previous samples
+        buffer = np.concatenate((np.array(self.history, dtype=float), values))
+        sums = np.concatenate(((0.0,), np.cumsum(buffer)))
+        end = np.arange(len(self.history), len(buffer)) + 1
+        start = np.maximum(end - self.window, 0)
+        filtered = (sums[end] - sums[start]) / (end - start)
+        self.history.extend(buffer[-self.window:])
+        self.total = float(np.sum(self.history))
+        return filtered
+
+
+class SinglePoleLowPass(Stage):
+    '''First order (exponential) IIR low-pass filter.
+
+    Output starts at the first sample, rather than ramping up from zero.
+
+    Args:
+        cutoff (float): -3 dB frequency (Hz)
+        sample_rate (float): rate samples arrive at (Hz)
+    '''
+    def __init__(self, cutoff, sample_rate):
+        if not 0 < cutoff < sample_rate / 2:
+            raise ValueError(f'cutoff must be between 0 and {sample_rate / 2} Hz, not {cutoff}')
+        self.alpha = 1 - exp(-2 * pi * cutoff / sample_rate)
+        self.reset()
+
+    def reset(self):
+        self.last = None
+
+    def update(self, value):
+        if self.last is None:
+            self.last = value
+        self.last += self.alpha * (value - self.last)
+        return self.last
+
+    def process(self, values):
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return values
+        if self.last is None:
+            self.last = values[0]
+        if lfilter is None:
+            filtered = np.array([self.update(value) for value in values])
+        else:
+            filtered, _ = lfilter((self.alpha,), (1, self.alpha - 1), values,
+                                  zi=((1 - self.alpha) * self.last,))
+            self.last = filtered[-1]
+        return filtered
+
+
+class Biquad(Stage):
+    '''Second order IIR filter (direct form II transposed).
+
+    Use `Biquad.low_pass` or `Biquad.notch` for common designs.
+    State starts at steady state for the first sample, so there is no
+    startup transient from large raw offsets.
+
+    Args:
+        b (iterable): three numerator coefficients
+        a (iterable): three denominator coefficients, a[0] is normalised to 1
+    '''
+    def __init__(self, b, a):
+        b = tuple(float(coefficient) for coefficient in b)
+        a = tuple(float(coefficient) for coefficient in a)
+        if len(b) != 3 or len(a) != 3:
+            raise ValueError('b and a must each have three coefficients')
+        if a[0] == 0:
+            raise ValueError('a[0] must not be 0')
+        self.b = tuple(coefficient / a[0] for coefficient in b)
+        self.a = tuple(coefficient / a[0] for coefficient in a)
+        self.reset()
+
+    @classmethod
+    def low_pass(cls, cutoff, sample_rate, q=0.7071):
+        '''Butterworth (by default) low-pass filter.
+
+        Args:
+            cutoff (float): -3 dB frequency (Hz)
+            sample_rate (float): rate samples arrive at (Hz)
+        Kwargs:
+            q (float): quality factor
+        '''
+        if not 0 < cutoff < sample_rate / 2:
+            raise ValueError(f'cutoff must be between 0 and {sample_rate / 2} Hz, not {cutoff}')
+        w0 = 2 * pi * cutoff / sample_rate
+        alpha = sin(w0) / (2 * q)
+        b = ((1 - cos(w0)) / 2, 1 - cos(w0), (1 - cos(w0)) / 2)
+        a = (1 + alpha, -2 * cos(w0), 1 - alpha)
+        return cls(b, a)
+
+    @classmethod
+    def notch(cls, frequency, sample_rate, q=30):
+        '''Notch filter, eg. for mains pickup.
+
+        Frequencies above the Nyquist frequency are aliased, so eg. 50 Hz
+        mains at an 80 Hz sample rate is notched at 30 Hz.
+
+        Args:
+            frequency (float): frequency to remove (Hz)
+            sample_rate (float): rate samples arrive at (Hz)
+        Kwargs:
+            q (float): quality factor, higher is narrower
+        '''
+        # fold frequency into the range 0 to sample_rate / 2
+        frequency %= sample_rate
+        frequency = min(frequency, sample_rate - frequency)
+        if not 0 < frequency < sample_rate / 2:
+            raise ValueError(f'{frequency} Hz alias can not be notched at {sample_rate} Hz')
+        w0 = 2 * pi * frequency / sample_rate
+        alpha = sin(w0) / (2 * q)
+        b = (1, -2 * cos(w0), 1)
+        a = (1 + alpha, -2 * cos(w0), 1 - alpha)
+        return cls(b, a)
+
+    def reset(self):
+        self.state = None
+
+    def settle(self, value):
+        '''Set state to the steady state for a constant input of `value`.
+        '''
+        b0, b1, b2 = self.b
+        _, a1, a2 = self.a
+        output = value * sum(self.b) / sum(self.a)
+        z2 = b2 * value - a2 * output
+        z1 = b1 * value - a1 * output + z2
+        self.state = [z1, z2]
+
+    def update(self, value):
+        if self.state is None:
+            self.settle(value)
+        b0, b1, b2 = self.b
+        _, a1, a2 = self.a
+        z1, z2 = self.state
+        output = b0 * value + z1
+        self.state = [b1 * value - a1 * output + z2,
+                      b2 * value - a2 * output]
+        return output
+
+    def process(self, values):
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return values
+        if self.state is None:
+            self.settle(values[0])
+        if lfilter is None:
+            return np.array([self.update(value) for value in values])
+        filtered, state = lfilter(self.b, self.a, values, zi=self.state)
+        self.state = list(state)
+        return filtered
+
+
+class Decimate(Stage):
+    '''Keep every `factor`th sample.
+
+    No anti-aliasing is done, so put a low-pass stage before this one.
+    '''
+    def __init__(self, factor):
+        if not isinstance(factor, int):
+            raise TypeError(f'factor must be an int, not {type(factor)}')
+        if factor < 1:
+            raise ValueError(f'factor must be at least 1, not {factor}')
+        self.factor = factor
+        self.reset()
+
+    def reset(self):
+        # number of samples since the last one kept
+        self.count = 0
+
+    def update(self, value):
+        self.count += 1
+        if self.count < self.factor:
+            return None
+        self.count = 0
+        return value
+
+    def process(self, values):
+        values = np.asarray(values, dtype=float)
+        filtered = values[self.factor - 1 - self.count::self.factor]
+        self.count = (self.count + len(values)) % self.factor
+        return filtered
+
+
+class Kalman(Stage):
+    '''Kalman filter tracking load and its drift rate.
+
+    The load is modelled as a level which changes by `drift` each sample,
+    with the drift itself wandering slowly. This follows slow creep/tare
+    drift without lag, while still smoothing sample noise.
+
+    The covariance (so the gains) doesn't depend on the samples and
+    converges, after which the gains are fixed. The batch form runs sample
+    by sample only until then, and filters the rest as a fixed second
+    order IIR filter.
+
+    Args:
+        measurement_variance (float): variance of raw sample noise
+    Kwargs:
+        level_variance (float): variance added to the level each sample
+        drift_variance (float): variance added to the drift each sample
+    '''
+    # relative change in gains below which they are taken as converged
+    GAIN_TOLERANCE = 1e-12
+
+    def __init__(self, measurement_variance, level_variance=1.0, drift_variance=1e-4):
+        if measurement_variance <= 0:
+            raise ValueError(f'measurement_variance must be positive, not {measurement_variance}')
+        self.measurement_variance = measurement_variance
+        self.level_variance = level_variance
+        self.drift_variance = drift_variance
+        self.reset()
+
+    def reset(self):
+        self.level = None
+        self.drift = 0.0
+        # covariance matrix [[p00, p01], [p01, p11]]
+        self.p00 = self.measurement_variance
+        self.p01 = 0.0
+        self.p11 = self.drift_variance
+        self.gains = None
+        # gains once converged, None until then
+        self.steady_gains = None
+
+    def step_gains(self):
+        '''Advance the covariance by one sample
+
+        Returns:
+            tuple: (level gain, drift gain) for the sample
+        '''
+        if self.steady_gains is not None:
+            return self.steady_gains
+        # predict
+        self.p00 += 2 * self.p01 + self.p11 + self.level_variance
+        self.p01 += self.p11
+        self.p11 += self.drift_variance
+        # correct
+        gain_level = self.p00 / (self.p00 + self.measurement_variance)
+        gain_drift = self.p01 / (self.p00 + self.measurement_variance)
+        self.p11 -= gain_drift * self.p01
+        self.p01 *= 1 - gain_level
+        self.p00 *= 1 - gain_level
+
+        gains = (gain_level, gain_drift)
+        if self.gains is not None and all(
+                abs(new - old) <= self.GAIN_TOLERANCE * abs(new)
+                for new, old in zip(gains, self.gains)):
+            self.steady_gains = gains
+        self.gains = gains
+        return gains
+
+    def update(self, value):
+        if self.level is None:
+            self.level = value
+            return self.level
+        gain_level, gain_drift = self.step_gains()
+        predicted = self.level + self.drift
+        residual = value - predicted
+        self.level = predicted + gain_level * residual
+        self.drift += gain_drift * residual
+        return self.level
+
+    def steady_filter(self):
+        '''Fixed IIR filter equal to the Kalman filter with steady gains
+
+        The state [level, drift] follows s[n] = A s[n-1] + K x[n].
+
+        Returns:
+            tuple: (b, a, A)
+        '''
+        gain_level, gain_drift = self.steady_gains
+        transition = np.array(((1 - gain_level, 1 - gain_level),
+                               (-gain_drift, 1 - gain_drift)))
+        (a00, a01), (a10, a11) = transition
+        b = (gain_level, gain_drift * a01 - gain_level * a11, 0)
+        a = (1, -(a00 + a11), a00 * a11 - a01 * a10)
+        return b, a, transition
+
+    def process(self, values):
+        values = np.asarray(values, dtype=float)
+        filtered = np.empty(len(values))
+        # run sample by sample while the gains are still changing
+        i = 0
+        while i < len(values) and (self.level is None or self.steady_gains is None):
+            filtered[i] = self.update(values[i])
+            i += 1
+        if i == len(values):
+            return filtered
+        if lfilter is None:
+            filtered[i:] = [self.update(value) for value in values[i:]]
+            return filtered
+
+        b, a, transition = self.steady_filter()
+        state = np.array((self.level, self.drift))
+        # outputs the state would give with no more input, as lfilter state
+        observe = np.vstack((transition[0], (transition @ transition)[0]))
+        first, second = observe @ state
+        filtered[i:], final = lfilter(b, a, values[i:], zi=(first, second + a[1] * first))
+        self.level, self.drift = np.linalg.solve(observe, (final[0], final[1] - a[1] * final[0]))
+        return filtered
+
+
+class Pipeline(Stage):
+    '''Chain of filter stages, applied in order.
+
+    Args:
+        *stages (Stage): stages to apply, first stage gets the raw samples
+    '''
+    def __init__(self, *stages):
+        for stage in stages:
+            if not isinstance(stage, Stage):
+                raise TypeError(f'stages must be Stage instances, not {type(stage)}')
+        self.stages = stages
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def update(self, value):
+        for stage in self.stages:
+            value = stage.update(value)
+            if value is None:
+                return None
+        return value
+
+    def process(self, values):
+        values = np.asarray(values, dtype=float)
+        for stage in self.stages:
+            values = stage.process(values)
+        return values
@@ -0,0 +1,107 @@
+'''Drive Raspberry Pi GPIO lines through the memory-mapped register block.
+
+`GpioMem` can be used in place of the RPi.GPIO module (eg. for
+`HX711(dout, pd_sck, gpio=GpioMem())`). Setting, clearing and reading a line
+is a single word write or read on `/dev/gpiomem`, which skips the argument
+parsing and channel lookup RPi.GPIO does on every call.
+
+Only BCM pin numbering and the first GPIO bank (pins 0-31) are supported.
+
+For testing off a Raspberry Pi, any file of at least `BLOCK_SIZE` bytes can
+be mapped instead (see `make_stand_in`). Writes to it can be checked, but
+levels written to the set/clear registers will not show up as inputs.
+'''
+import mmap
+import os
+
+
+# size of the mapped GPIO register block
+BLOCK_SIZE = 4096
+
+# register offsets (bytes) from the start of the block
+GPFSEL0 = 0x00
+GPSET0 = 0x1c
+GPCLR0 = 0x28
+GPLEV0 = 0x34
+# word indexes of the set/clear/level registers, for the 32 bit view
+SET_INDEX = GPSET0 // 4
+CLEAR_INDEX = GPCLR0 // 4
+LEVEL_INDEX = GPLEV0 // 4
+
+
+def make_stand_in(path):
+    '''Create a zeroed file to map in place of `/dev/gpiomem`
+
+    Args:
+        path (str): path of file to create (overwritten if it exists)
+    Returns:
+        str: `path`
+    '''
+    with open(path, 'wb') as stand_in:
+        stand_in.write(bytes(BLOCK_SIZE))
+    return path
+
+
+class GpioMem:
+    '''RPi.GPIO-like access to GPIO lines through `/dev/gpiomem`.
+
+    Kwargs:
+        path (str): register block to map, a stand-in file can be used for testing
+    '''
+    BCM = 'BCM'
+    # function select values
+    IN = 0b000
+    OUT = 0b001
+
+    def __init__(self, path='/dev/gpiomem'):
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            # character devices report a size of 0
+            size = os.fstat(fd).st_size
+            if 0 < size < BLOCK_SIZE:
+                raise ValueError(f'{path} is smaller than {BLOCK_SIZE} bytes')
+            self.block = mmap.mmap(fd, BLOCK_SIZE, mmap.MAP_SHARED,
+                                   mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        # 32 bit view of registers, so each access is one word
+        self.registers = memoryview(self.block).cast('I')
+        self.outputs = set()
+
+    def setmode(self, mode):
+        if mode != self.BCM:
+            raise NotImplementedError(f'Only BCM pin numbering is supported, not {mode}')
+
+    def setup(self, channel, direction):
+        '''Set the function of `channel` to input or output
+        '''
+        if not 0 <= channel < 32:
+            raise ValueError(f'channel must be between 0 and 31, not {channel}')
+        if direction not in (self.IN, self.OUT):
+            raise ValueError(f'direction must be GpioMem.IN or GpioMem.OUT, not {direction}')
+        index = GPFSEL0 // 4 + channel // 10
+        shift = 3 * (channel % 10)
+        function_select = self.registers[index] & ~(0b111 << shift)
+        self.registers[index] = function_select | (direction << shift)
+        if direction == self.OUT:
+            self.outputs.add(channel)
+        else:
+            self.outputs.discard(channel)
+
+    def output(self, channel, value):
+        # writing a 1 to a bit of GPSET0/GPCLR0 only affects that pin
+        if value:
+            self.registers[SET_INDEX] = 1 << channel
+        else:
+            self.registers[CLEAR_INDEX] = 1 << channel
+
+    def input(self, channel):
+        return (self.registers[LEVEL_INDEX] >> channel) & 1
+
+    def cleanup(self):
+        '''Return output channels to inputs and unmap the register block
+        '''
+        for channel in tuple(self.outputs):
+            self.setup(channel, self.IN)
+        self.registers.release()
+        self.block.close()
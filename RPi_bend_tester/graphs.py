@@ -25,28 +25,40 @@ def easy_plot(x, y, scat_fmt='kx3', trend_fmt='k-', y_error=None, return_r2=True
             return_r2==False: (gradient, intercept)
             return_r2==True: ((gradient, intercept), r squared)
     '''
+    m_c, _ = fit_linear(x, y)
+    plot_fit(x, y, m_c, scat_fmt=scat_fmt, trend_fmt=trend_fmt, y_error=y_error, show=show)
+    if return_r2:
+        return tuple(m_c), float(r_squared(x, y, m_c))
+    return tuple(m_c)
+
+def plot_fit(x, y, coefficients, scat_fmt='kx3', trend_fmt='k-', y_error=None, show=True):
+    '''Plot scatter of `x` and `y` with a fitted polynomial.
+    Use with coefficients from `fit_linear` or `fit_poly` for one dataset.
+    
+    Args:
+        x (tuple/list/numpy.ndarray): values of data points for the horizontal axis
+        y (tuple/list/numpy.ndarray): values of data points for the vertical axis
+        coefficients (array-like): polynomial coefficients, highest power first
+    Kwargs:
+        scat_fmt (str): format for scatter plot, as `easy_plot`
+        trend_fmt (str): format for trendline, passed directly to matplotlib.pyplot.plot
+        y_error (scalar/array-like): if none, no error bars are plotted (default)
+            otherwise, plots error bars on graph according to values given
+        show (bool): whether to show the graph (plt.show(block=False))
+    Returns:
+        None
+    '''
     if y_error is None:
         plt.scatter(x, y, c=scat_fmt[0], marker=scat_fmt[1])
     else:
         plt.errorbar(x, y, yerr=y_error, color=scat_fmt[0], marker=scat_fmt[1], capsize=int(scat_fmt[2]), elinewidth=1, ls='none')
-        # plt.errorbar(x, y, yerr=y_error, ls='none', color=scat_fmt[0], marker=scat_fmt[1]) 
-    # Get coefficients of linear regression
-    m_c = np.polyfit(x, y, 1)
-    trend_func = np.poly1d(m_c)
-    # calculate r squared for the linear regression
-    if return_r2:
-        if not isinstance(y, np.ndarray):
-            x = np.array(x)
-            y = np.array(y)
-        r2 = 1 - np.sum((y - trend_func(x))**2) / np.sum((y-np.mean(y))**2)
-    # plot trend line
-    min_max_x = np.array((np.min(x), np.max(x)))
-    plt.plot(min_max_x, trend_func(min_max_x), trend_fmt)
+    trend_func = np.poly1d(coefficients)
+    # plot trend line, sampled finely enough for curves
+    degree = len(coefficients) - 1
+    trend_x = np.linspace(np.min(x), np.max(x), 2 if degree <= 1 else 100)
+    plt.plot(trend_x, trend_func(trend_x), trend_fmt)
     if show:
         plt.show(block=False)
-    if return_r2:
-        return tuple(m_c), r2
-    return tuple(m_c)
 
 def formal_plot(x, y, y_error=None, title='', x_title='', y_title='', x_units=[], y_units=[], show=True):
     '''Plots a `x` and `y` for a formal looking graph.
@@ -162,6 +174,8 @@ def chi_r_2(observed, observed_error, expected, ddof=0):
     >1 implies poor fit (line of fit is bad description, or errors to small)
     1 implies a good fit. Values closer to 1 are better.
     
+    Arrays may be 2-D (datasets, points) to find the statistic of each dataset at once.
+    
     Calculated as:
         sum( ((observed - expected) / observed_error)**2 ) / dof
         where the degrees of freedom (dof) are:
@@ -175,15 +189,175 @@ def chi_r_2(observed, observed_error, expected, ddof=0):
         ddof (int): number of variables in fitting function
             degrees of freedom = len(observed) - 1 - ddof
     Returns:
-        float: reduced chi squared statistic
+        float/numpy.ndarray: reduced chi squared statistic (of each dataset)
     '''
-    length = len(observed)
-    if isinstance(observed_error, (float, int)):
-        observed_error = np.array((observed_error,) * length)
-    # ensure all inputs are an np.ndarray
-    observed, observed_error, expected = np.array((observed, observed_error, expected))
+    observed = np.asarray(observed, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+    # a numeric observed_error is broadcast to all data points
+    observed_error = np.asarray(observed_error, dtype=float)
+    length = observed.shape[-1]
     # calculate degrees of freedom
     dof = length - 1 - ddof
     if dof < 1:
         raise RuntimeError(f'Degrees of freedom must be at least 1, not {dof}.')
-    return np.sum(((observed - expected) / observed_error)**2) / dof
+    return np.sum(((observed - expected) / observed_error)**2, axis=-1) / dof
+
+def _stack(x, y, y_error):
+    '''Broadcast `x`, `y` and `y_error` to 2-D arrays of shape (datasets, points)
+    
+    Returns:
+        tuple: (x, y, y_error, whether `y` was 1-D, whether `y_error` was given)
+    '''
+    y = np.asarray(y, dtype=float)
+    single = y.ndim == 1
+    y = np.atleast_2d(y)
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    weighted = y_error is not None
+    if weighted:
+        y_error = np.broadcast_to(np.asarray(y_error, dtype=float), y.shape)
+    else:
+        y_error = np.ones(y.shape)
+    return x, y, y_error, single, weighted
+
+def fit_linear(x, y, y_error=None):
+    '''Weighted linear least squares fit of one or many datasets, without plotting.
+    
+    Closed form, so much faster than `fit_poly` with degree 1.
+    
+    Args:
+        x (array-like): 1-D values shared by all datasets, or 2-D like `y`
+        y (array-like): 1-D for one dataset, 2-D (datasets, points) for many
+    Kwargs:
+        y_error (scalar/array-like): standard error in `y`, broadcast to `y`
+            if given, errors are taken as absolute
+            if None, covariance is scaled by the residual variance (as np.polyfit(..., cov=True))
+    Returns:
+        tuple: (coefficients, covariance)
+            coefficients: (gradient, intercept), shape (2,) or (datasets, 2)
+            covariance: of coefficients, shape (2, 2) or (datasets, 2, 2)
+    '''
+    x, y, y_error, single, weighted = _stack(x, y, y_error)
+    length = y.shape[-1]
+    if length < 2:
+        raise ValueError(f'At least 2 points needed for a linear fit, not {length}')
+    # centre x and y to avoid losing precision on large raw readings
+    w = 1 / y_error**2
+    s = np.sum(w, axis=-1)
+    x_mean = np.sum(w * x, axis=-1) / s
+    y_mean = np.sum(w * y, axis=-1) / s
+    dx = x - x_mean[:, None]
+    sxx = np.sum(w * dx**2, axis=-1)
+    gradient = np.sum(w * dx * (y - y_mean[:, None]), axis=-1) / sxx
+    intercept = y_mean - gradient * x_mean
+
+    # covariance of (gradient, intercept)
+    var_gradient = 1 / sxx
+    covariance = np.empty((len(y), 2, 2))
+    covariance[:, 0, 0] = var_gradient
+    covariance[:, 0, 1] = covariance[:, 1, 0] = -x_mean * var_gradient
+    covariance[:, 1, 1] = 1 / s + x_mean**2 * var_gradient
+    if length > 2 and not weighted:
+        residuals = y - (gradient[:, None] * x + intercept[:, None])
+        covariance *= (np.sum(residuals**2, axis=-1) / (length - 2))[:, None, None]
+
+    coefficients = np.stack((gradient, intercept), axis=-1)
+    if single:
+        return coefficients[0], covariance[0]
+    return coefficients, covariance
+
+def fit_poly(x, y, degree=1, y_error=None):
+    '''Weighted polynomial least squares fit of one or many datasets, without plotting.
+    
+    All datasets are solved at once with a stacked QR decomposition.
+    
+    Args:
+        x (array-like): 1-D values shared by all datasets, or 2-D like `y`
+        y (array-like): 1-D for one dataset, 2-D (datasets, points) for many
+    Kwargs:
+        degree (int): degree of polynomial
+        y_error (scalar/array-like): as `fit_linear`
+    Returns:
+        tuple: (coefficients, covariance)
+            coefficients: highest power first (as np.polyfit), shape (degree+1,) or (datasets, degree+1)
+            covariance: of coefficients, shape (degree+1, degree+1) or (datasets, degree+1, degree+1)
+    '''
+    x, y, y_error, single, weighted = _stack(x, y, y_error)
+    terms = degree + 1
+    length = y.shape[-1]
+    if length < terms:
+        raise ValueError(f'At least {terms} points needed for a degree {degree} fit, not {length}')
+    vander = x[..., None] ** np.arange(degree, -1, -1)
+    # scale columns to the same size so the Vandermonde matrix is well conditioned
+    column_scale = np.max(np.abs(vander), axis=-2)
+    column_scale[column_scale == 0] = 1
+    a = vander / column_scale[:, None, :] / y_error[..., None]
+    b = y / y_error
+    q, r = np.linalg.qr(a)
+    scaled = np.linalg.solve(r, np.einsum('dpt,dp->dt', q, b)[..., None])[..., 0]
+    r_inv = np.linalg.inv(r)
+    covariance = r_inv @ np.swapaxes(r_inv, -1, -2)
+    if length > terms and not weighted:
+        residuals = b - np.einsum('dpt,dt->dp', a, scaled)
+        covariance *= (np.sum(residuals**2, axis=-1) / (length - terms))[:, None, None]
+
+    # undo column scaling
+    coefficients = scaled / column_scale
+    covariance /= column_scale[:, :, None] * column_scale[:, None, :]
+
+    if single:
+        return coefficients[0], covariance[0]
+    return coefficients, covariance
+
+def r_squared(x, y, coefficients):
+    '''Coefficient of determination for polynomial fits of one or many datasets.
+    
+    Args:
+        x (array-like): 1-D values shared by all datasets, or 2-D like `y`
+        y (array-like): 1-D for one dataset, 2-D (datasets, points) for many
+        coefficients (array-like): from `fit_linear` or `fit_poly`
+    Returns:
+        float/numpy.ndarray: r squared of each dataset
+    '''
+    y = np.asarray(y, dtype=float)
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    coefficients = np.asarray(coefficients, dtype=float)
+    # evaluate polynomial(s) with Horner's method
+    fitted = np.zeros(y.shape)
+    for i in range(coefficients.shape[-1]):
+        fitted = fitted * x + coefficients[..., i, None]
+    residual = np.sum((y - fitted)**2, axis=-1)
+    total = np.sum((y - np.mean(y, axis=-1, keepdims=True))**2, axis=-1)
+    return 1 - residual / total
+
+def rolling_slope(x, y, window):
+    '''Gradient of linear regression over a sliding window, eg. for drift rate traces.
+    
+    Uses cumulative sums, so the cost doesn't depend on `window`.
+    
+    Args:
+        x (array-like): 1-D values shared by all datasets, or 2-D like `y`
+        y (array-like): 1-D for one dataset, 2-D (datasets, points) for many
+        window (int): number of points in each window
+    Returns:
+        numpy.ndarray: gradient of each window, shape (points - window + 1,)
+            or (datasets, points - window + 1)
+    '''
+    y = np.asarray(y, dtype=float)
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    if not 2 <= window <= y.shape[-1]:
+        raise ValueError(f'window must be between 2 and {y.shape[-1]}, not {window}')
+    # centre to avoid losing precision in the cumulative sums
+    x = x - np.mean(x, axis=-1, keepdims=True)
+    y = y - np.mean(y, axis=-1, keepdims=True)
+
+    def window_sums(values):
+        sums = np.cumsum(values, axis=-1)
+        zero = np.zeros(values.shape[:-1] + (1,))
+        sums = np.concatenate((zero, sums), axis=-1)
+        return sums[..., window:] - sums[..., :-window]
+
+    sx = window_sums(x)
+    sy = window_sums(y)
+    sxx = window_sums(x * x)
+    sxy = window_sums(x * y)
+    return (window * sxy - sx * sy) / (window * sxx - sx**2)
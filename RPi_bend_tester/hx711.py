@@ -1,12 +1,18 @@
-import RPi.GPIO as GPIO
-from time import sleep
+from contextlib import contextmanager
+from time import sleep, perf_counter
 import threading
 
 
 
 class HX711:
 
-    def __init__(self, dout, pd_sck, gain=128):
+    def __init__(self, dout, pd_sck, gain=128, gpio=None):
+        # GPIO backend, either the RPi.GPIO module (default) or something with
+        # the same interface, eg. gpiomem.GpioMem for direct register access.
+        if gpio is None:
+            import RPi.GPIO as gpio
+        self.gpio = gpio
+
         self.PD_SCK = pd_sck
 
         self.DOUT = dout
@@ -15,9 +21,9 @@ class HX711:
         # software try to access get values from the class at the same time.
         self.readLock = threading.Lock()
         
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.PD_SCK, GPIO.OUT)
-        GPIO.setup(self.DOUT, GPIO.IN)
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(self.PD_SCK, self.gpio.OUT)
+        self.gpio.setup(self.DOUT, self.gpio.IN)
 
         self.GAIN = 0
 
@@ -28,8 +34,43 @@ class HX711:
         self.OFFSET = 1
         self.lastVal = int(0)
 
+        # Optional streaming filter (eg. filters.Pipeline) applied to samples
+        # between read_long and get_weight.  While a filter is set, a
+        # background thread feeds it every sample at the HX711 data rate.
+        self.filter = None
+        self.acquisitionThread = None
+        self.stopAcquisition = threading.Event()
+        # Latest filtered value, and how many have been output, guarded by
+        # filteredReady.
+        self.filteredReady = threading.Condition()
+        self.filteredValue = None
+        self.filteredCount = 0
+        # Exception that stopped the background thread, re-raised by
+        # read_filtered.
+        self.acquisitionError = None
+        # Time the background thread sleeps between checks of DOUT.  It
+        # sleeps rather than spinning, so it doesn't hold the GIL while
+        # waiting for each conversion (12.5ms at 80Hz).
+        self.POLL_INTERVAL = 0.001
+
         self.DEBUG_PRINTING = False
 
+        # The HX711 powers down if PD_SCK is held high for more than 60us, so
+        # a clock pulse longer than this (eg. if the process is preempted
+        # mid-word) means the word read out cannot be trusted.
+        self.POWER_DOWN_TIME = 0.00006
+        # Raw 24bit words to treat as corrupt reads, empty by default.  Every
+        # 24bit word is a valid two's complement reading (eg. 0xffffff is -1),
+        # so only add words here that can't be real readings for your setup,
+        # eg. 0xffffff if DOUT floats high and the cell never reads near 0.
+        self.INVALID_WORDS = ()
+        # Number of times an invalid read is retried before giving up.
+        self.MAX_RETRIES = 5
+        # Count of invalid reads seen (and retried) since the last reset.
+        self.invalidReads = 0
+        # Longest PD_SCK high phase seen during the current word.
+        self.longestPulse = 0
+
         self.byte_format = 'MSB'
         self.bit_format = 'MSB'
 
@@ -44,7 +85,7 @@ class HX711:
 
     
     def is_ready(self):
-        return GPIO.input(self.DOUT) == 0
+        return self.gpio.input(self.DOUT) == 0
 
 
     def set_gain(self, gain):
@@ -55,7 +96,7 @@ class HX711:
         elif gain is 32:
             self.GAIN = 2
 
-        GPIO.output(self.PD_SCK, False)
+        self.gpio.output(self.PD_SCK, False)
 
         # Read out a set of raw bytes and throw it away.
         self.readRawBytes()
@@ -75,9 +116,18 @@ class HX711:
        # Clock HX711 Digital Serial Clock (PD_SCK).  DOUT will be
        # ready 1us after PD_SCK rising edge, so we sample after
        # lowering PD_SCL, when we know DOUT will be stable.
-       GPIO.output(self.PD_SCK, True)
-       GPIO.output(self.PD_SCK, False)
-       value = GPIO.input(self.DOUT)
+       # The length of the high phase is timed, as holding PD_SCK high for
+       # too long will power down the HX711 part way through a word.  The
+       # timer starts before the rising edge, so a stall straight after it
+       # is still counted.
+       start = perf_counter()
+       self.gpio.output(self.PD_SCK, True)
+       self.gpio.output(self.PD_SCK, False)
+       pulse = perf_counter() - start
+       value = self.gpio.input(self.DOUT)
+
+       if pulse > self.longestPulse:
+          self.longestPulse = pulse
 
        # Convert Boolean to int and return it.
        return int(value)
@@ -98,15 +148,13 @@ class HX711:
        # Return the packed byte.
        return byteValue 
         
-    def readRawBytes(self):
-        # Wait for and get the Read Lock, incase another thread is already
-        # driving the HX711 serial interface.
-        self.readLock.acquire()
-
+    def readRawWord(self):
         # Wait until HX711 is ready for us to read a sample.
         while not self.is_ready():
            pass
 
+        self.longestPulse = 0
+
         # Read three bytes of data from the HX711.
         firstByte  = self.readNextByte()
         secondByte = self.readNextByte()
@@ -118,6 +166,53 @@ class HX711:
            # Clock a bit out of the HX711 and throw it away.
            self.readNextBit()
 
+        return firstByte, secondByte, thirdByte
+
+    def is_valid_word(self, dataBytes):
+        '''Check whether the last word read out of the HX711 can be trusted
+
+        A word is invalid if any PD_SCK high phase while reading it exceeded
+        `self.POWER_DOWN_TIME`, or if it is one of `self.INVALID_WORDS`.
+
+        Args:
+            dataBytes (tuple): three raw bytes, in the order they were read
+        Returns:
+            bool: whether the word is valid
+        '''
+        if self.longestPulse > self.POWER_DOWN_TIME:
+            return False
+
+        word = (dataBytes[0] << 16) | (dataBytes[1] << 8) | dataBytes[2]
+        return word not in self.INVALID_WORDS
+
+    def readRawBytes(self):
+        # Wait for and get the Read Lock, incase another thread is already
+        # driving the HX711 serial interface.
+        self.readLock.acquire()
+
+        # Re-read straight away if the word is corrupt, rather than leaving it
+        # to be trimmed out of an average later.
+        dataBytes = self.readRawWord()
+        retries = 0
+        while not self.is_valid_word(dataBytes):
+           self.invalidReads += 1
+
+           if retries >= self.MAX_RETRIES:
+              self.readLock.release()
+              raise RuntimeError(f'HX711::readRawBytes(): no valid read after {retries} retries')
+           retries += 1
+
+           if self.DEBUG_PRINTING:
+              print("Invalid read, retrying:", dataBytes, self.longestPulse)
+
+           # If the HX711 powered down mid-word it will come back up on
+           # Channel A with gain of 128, so the next sample would be from the
+           # wrong channel/gain.  Throw it away too.
+           if self.longestPulse > self.POWER_DOWN_TIME and self.get_gain() != 128:
+              self.readRawWord()
+
+           dataBytes = self.readRawWord()
+
         # Release the Read Lock, now that we've finished driving the HX711
         # serial interface.
         self.readLock.release()           
@@ -125,9 +220,9 @@ class HX711:
         # Depending on how we're configured, return an orderd list of raw byte
         # values.
         if self.byte_format == 'LSB':
-           return thirdByte, secondByte, firstByte
+           return dataBytes[2], dataBytes[1], dataBytes[0]
         else:
-           return firstByte, secondByte, thirdByte
+           return dataBytes
 
 
     def read_long(self):
@@ -155,18 +250,28 @@ class HX711:
         # Return the sample value we've read from the HX711.
         return int(signedIntValue)
 
-    def read_average(self, times=3):
+    def read_average(self, times=3, trim=0.2):
         '''Find mean value of `times` readings
         
         Finds median instead if `times` is less than 5
+
+        Corrupt reads are already retried by `readRawBytes`, so `trim` can be
+        lowered to keep more of the samples taken.
+
+        Kwargs:
+            times (int): number of readings taken
+            trim (float): fraction of readings trimmed from each end
         '''
         # Make sure we've been asked to take a rational amount of samples.
         if times <= 0:
             raise ValueError("HX711()::read_average(): times must >= 1!!")
+        if not 0 <= trim < 0.5:
+            raise ValueError(f"HX711()::read_average(): trim must be between 0 and 0.5, not {trim}")
 
         # If we're only average across one value, just read it and return it.
         if times == 1:
-            return self.read_long()
+            with self.acquisition_paused():
+                return self.read_long()
 
         # If we're averaging across a low amount of values, just take the
         # median.
@@ -177,16 +282,17 @@ class HX711:
         # the outliers, then take the mean of the remaining set.
         valueList = []
 
-        for _ in range(times):
-            valueList.append(self.read_long())
+        with self.acquisition_paused():
+            for _ in range(times):
+                valueList.append(self.read_long())
 
         valueList.sort()
 
-        # We'll be trimming 20% of outlier samples from top and bottom of collected set.
-        trimAmount = int(len(valueList) * 0.2)
+        # We'll be trimming `trim` of outlier samples from top and bottom of collected set.
+        trimAmount = int(len(valueList) * trim)
 
         # Trim the edge case values.
-        valueList = valueList[trimAmount:-trimAmount]
+        valueList = valueList[trimAmount:len(valueList) - trimAmount]
 
         # Return the mean of remaining samples.
         return sum(valueList) / len(valueList)
@@ -199,14 +305,15 @@ class HX711:
        if times <= 0:
           raise ValueError("HX711::read_median(): times must be greater than zero!")
       
-       # If times == 1, just return a single reading.
-       if times == 1:
-          return self.read_long()
-
        valueList = []
 
-       for _ in range(times):
-          valueList.append(self.read_long())
+       with self.acquisition_paused():
+          for _ in range(times):
+             valueList.append(self.read_long())
+
+       # If times == 1, just return a single reading.
+       if times == 1:
+          return valueList[0]
 
        valueList.sort()
 
@@ -219,7 +326,7 @@ class HX711:
           midpoint = len(valueList) // 2
           return sum(valueList[midpoint-1:midpoint]) / 2.0
 
-    def read_pulse_average(self, times=15, duration=120, spacing=5, pause=60):
+    def read_pulse_average(self, times=15, duration=120, spacing=5, pause=60, trim=0.2):
         '''Find average reading
         
         Designed to take measurements - useful for tare and calibration.
@@ -235,26 +342,134 @@ class HX711:
             duration (int): total time taken for tare (seconds)
             spacing (int): time between repeats (seconds)
             pause (int): time paused before readings for actual tare taken
+            trim (float): fraction of each repeat's readings trimmed from
+                each end, see read_average
         '''
-        # record measurements during pause for debugging purposes
-        number_repeats = pause // spacing
-        pause_values = []
-        for _ in range(number_repeats):
-            pause_values.append(self.read_average(times))
-            sleep(spacing)
-
-        # take values for tare
-        number_repeats = duration // spacing
-        values = []
-        for _ in range(number_repeats):
-            values.append(self.read_average(times))
-            sleep(spacing)
-        value = sum(values) / len(values)
+        # Pause filtered acquisition for the whole measurement, rather than
+        # restarting it between repeats.
+        with self.acquisition_paused():
+            # record measurements during pause for debugging purposes
+            number_repeats = pause // spacing
+            pause_values = []
+            for _ in range(number_repeats):
+                pause_values.append(self.read_average(times, trim))
+                sleep(spacing)
+
+            # take values for tare
+            number_repeats = duration // spacing
+            values = []
+            for _ in range(number_repeats):
+                values.append(self.read_average(times, trim))
+                sleep(spacing)
+            value = sum(values) / len(values)
 
         return value, pause_values, values
 
+    def set_filter(self, sample_filter):
+        '''Set a streaming filter for get_value and get_weight to use
+
+        Filter coefficients assume samples arrive at a steady rate, so rather
+        than being fed only when a weight is asked for, the filter is fed
+        every sample by a background thread reading back-to-back at the HX711
+        data rate (10 or 80 Hz, set by the RATE pin).  Design filters for
+        that rate, whatever rate get_weight is called at.
+
+        read_average, read_median, read_pulse_average and tare take their
+        own samples, so they pause the background thread while they run.
+        The filter is reset when it restarts, rather than carrying on across
+        the gap.  Don't call read_long directly while a filter is set.
+
+        Args:
+            sample_filter (filters.Stage/None): filter given each sample from
+                read_long, None to stop and go back to read_median
+        '''
+        self.stop_acquisition()
+        self.filter = sample_filter
+        if sample_filter is not None:
+            self.start_acquisition()
+
+    def start_acquisition(self):
+        # Feed every sample through the filter in a background thread.
+        if self.filter is None:
+            raise RuntimeError("HX711::start_acquisition(): no filter set, use set_filter()")
+        if self.acquisitionThread is not None:
+            return
+
+        self.filter.reset()
+        with self.filteredReady:
+            self.filteredValue = None
+            self.filteredCount = 0
+            self.acquisitionError = None
+        self.stopAcquisition.clear()
+        self.acquisitionThread = threading.Thread(target=self.acquire, daemon=True)
+        self.acquisitionThread.start()
+
+    def stop_acquisition(self):
+        if self.acquisitionThread is None:
+            return
+        self.stopAcquisition.set()
+        self.acquisitionThread.join()
+        self.acquisitionThread = None
+
+    @contextmanager
+    def acquisition_paused(self):
+        '''Stop the background thread (if running) until the block ends
+        '''
+        filtering = self.acquisitionThread is not None
+        self.stop_acquisition()
+        try:
+            yield
+        finally:
+            if filtering:
+                self.start_acquisition()
+
+    def acquire(self):
+        # Waiting for each conversion before reading means this runs at the
+        # HX711 data rate.
+        try:
+            while not self.stopAcquisition.is_set():
+                if not self.is_ready():
+                    self.stopAcquisition.wait(self.POLL_INTERVAL)
+                    continue
+                value = self.filter.update(self.read_long())
+                if value is None:
+                    continue
+                with self.filteredReady:
+                    self.filteredValue = value
+                    self.filteredCount += 1
+                    self.filteredReady.notify_all()
+        except Exception as error:
+            # Hand the error to read_filtered, rather than leaving it waiting.
+            with self.filteredReady:
+                self.acquisitionError = error
+                self.filteredReady.notify_all()
+
+    def read_filtered(self, timeout=5):
+        '''Wait for the next output of `self.filter` and return it
+
+        Raises the error that stopped the background thread, if any.
+
+        Kwargs:
+            timeout (float): longest time to wait (seconds)
+        '''
+        if self.acquisitionThread is None:
+            raise RuntimeError("HX711::read_filtered(): no filter set, use set_filter()")
+
+        with self.filteredReady:
+            count = self.filteredCount
+            if not self.filteredReady.wait_for(
+                    lambda: self.filteredCount > count or self.acquisitionError is not None,
+                    timeout):
+                raise RuntimeError(f"HX711::read_filtered(): no filtered value within {timeout}s")
+            if self.acquisitionError is not None:
+                raise self.acquisitionError
+            return self.filteredValue
+
     # Compatibility function, uses channel A version
+    # `times` is ignored if a filter is set
     def get_value(self, times=3):
+        if self.filter is not None:
+            return self.read_filtered() - self.get_offset()
         return self.read_median(times) - self.get_offset()
 
     # Compatibility function, uses channel A version
@@ -265,7 +480,7 @@ class HX711:
 
     
     # Sets tare for channel A for compatibility purposes
-    def tare(self, times=15, duration=120, spacing=5, pause=60):
+    def tare(self, times=15, duration=120, spacing=5, pause=60, trim=0.2):
         '''Find reading at zero weight, and tare balance
         
         Finds average value using self.read_pulse_average
@@ -277,6 +492,8 @@ class HX711:
             duration (int): total time taken for tare (seconds)
             spacing (int): time between repeats (seconds)
             pause (int): time paused before readings for actual tare taken
+            trim (float): fraction of each repeat's readings trimmed from
+                each end, see read_average
         Returns:
         '''
         # Backup REFERENCE_UNIT value
@@ -286,7 +503,8 @@ class HX711:
         value, pause_values, values = self.read_pulse_average(times=times,
                                                               duration=duration,
                                                               spacing=spacing,
-                                                              pause=pause
+                                                              pause=pause,
+                                                              trim=trim
                                                               )
 
         if self.DEBUG_PRINTING:
@@ -344,8 +562,8 @@ class HX711:
         # Cause a rising edge on HX711 Digital Serial Clock (PD_SCK).  We then
         # leave it held up and wait 100 us.  After 60us the HX711 should be
         # powered down.
-        GPIO.output(self.PD_SCK, False)
-        GPIO.output(self.PD_SCK, True)
+        self.gpio.output(self.PD_SCK, False)
+        self.gpio.output(self.PD_SCK, True)
 
         sleep(0.0001)
 
@@ -359,7 +577,7 @@ class HX711:
         self.readLock.acquire()
 
         # Lower the HX711 Digital Serial Clock (PD_SCK) line.
-        GPIO.output(self.PD_SCK, False)
+        self.gpio.output(self.PD_SCK, False)
 
         # Wait 100 us for the HX711 to power back up.
         sleep(0.0001)
@@ -378,6 +596,7 @@ class HX711:
     def reset(self):
         self.power_down()
         self.power_up()
+        self.invalidReads = 0
 
 
 # EOF - hx711.py
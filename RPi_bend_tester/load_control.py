@@ -0,0 +1,242 @@
+'''Closed-loop load control of a GRBL crosshead from live HX711 readings.
+
+`LoadController` runs a PI controller at a fixed rate. Each cycle it reads
+the load, works out a crosshead speed and sends a short GRBL jog
+(GrblSerial.jog_z) lasting one cycle, so the crosshead keeps moving
+smoothly while the next reading is taken. Jogs are cancelled
+(GrblSerial.jog_cancel) when the direction changes or the test ends.
+
+Try it without hardware (see simulation.py):
+    python load_control.py
+'''
+from time import perf_counter, sleep
+
+# shortest jog sent (mm), GRBL rounds to 3 decimal places
+MIN_JOG = 0.001
+# HX711 output data rate with RATE pin high (Hz)
+MAX_RATE = 80
+
+
+class LoadController:
+    '''PI load controller driving a GrblSerial with jogs.
+
+    Positive speed is towards increasing load, ie. down (-Z) by default.
+
+    Args:
+        hx (HX711): load cell amplifier, calibrated to the units of setpoints
+        grbl (GrblSerial): controller, bounds are taken from min_z/max_z
+    Kwargs:
+        kp (float): proportional gain (mm/s per unit load error)
+        ki (float): integral gain (mm/s per unit load error second)
+        max_speed (float): fastest crosshead speed (mm/s), defaults to grbl.feed_rate / 60
+        rate (float): control loop rate (Hz), at least 20 Hz is recommended
+        times (int): readings averaged for each sample (HX711.get_weight)
+        max_load (float): load to stop at whatever the setpoint
+        direction (int): -1 if load increases as Z decreases, 1 if as Z increases
+    '''
+    def __init__(self, hx, grbl, kp=0.01, ki=0.002, max_speed=None, rate=20, times=1,
+                 max_load=float('inf'), direction=-1):
+        if kp < 0 or ki < 0:
+            raise ValueError('kp and ki must not be negative')
+        if not 0 < rate * times <= MAX_RATE:
+            raise ValueError(f'rate * times must be between 0 and {MAX_RATE} readings/s, not {rate * times}')
+        if direction not in (-1, 1):
+            raise ValueError(f'direction must be -1 or 1, not {direction}')
+        if max_speed is None:
+            max_speed = grbl.feed_rate / 60
+        if max_speed <= 0:
+            raise ValueError(f'max_speed must be positive, not {max_speed}')
+        self.hx = hx
+        self.grbl = grbl
+        self.kp = kp
+        self.ki = ki
+        self.max_speed = max_speed
+        self.period = 1 / rate
+        self.times = times
+        self.max_load = max_load
+        self.direction = direction
+        self.reset()
+
+    def reset(self):
+        '''Clear integral and last jog direction
+        '''
+        self.integral = 0.0
+        # speed of last jog sent, 0 when not jogging
+        self.speed = 0.0
+        # why the last run stopped early, None if it ran for its duration
+        self.stop_reason = None
+
+    def speed_for(self, error, dt):
+        '''PI controller output, with anti-windup
+
+        While the output is saturated (past `max_speed`, or towards a Z bound
+        it is at), the integral is only updated if `error` winds it back
+        (conditional integration).
+
+        Args:
+            error (float): setpoint - load
+            dt (float): time since last update (s)
+        Returns:
+            float: crosshead speed (mm/s), positive towards increasing load
+        '''
+        integral = self.integral + error * dt
+        speed = self.kp * error + self.ki * integral
+        # can't move further towards a bound we're at
+        z = self.grbl.current_z
+        at_bound = ((speed * self.direction > 0 and z >= self.grbl.max_z)
+                    or (speed * self.direction < 0 and z <= self.grbl.min_z))
+        saturated = at_bound or abs(speed) > self.max_speed
+        if not saturated or error * speed < 0:
+            self.integral = integral
+        if at_bound:
+            return 0.0
+        if abs(speed) > self.max_speed:
+            speed = self.max_speed if speed > 0 else -self.max_speed
+        return speed
+
+    def jog(self, speed):
+        '''Send a jog at `speed` lasting one cycle, clipped to Z bounds
+
+        Cancels jogs already queued if changing direction, then waits for the
+        crosshead to decelerate to a stop before reading its position.
+
+        Returns:
+            bool: False if the GRBL controller refused the jog, eg. 'error:9'
+                in an alarm, otherwise True
+        '''
+        if speed * self.speed < 0 or speed == 0:
+            if self.speed != 0:
+                self.grbl.jog_cancel()
+                self.grbl.get_position(wait_idle=True)
+            self.speed = 0.0
+            if speed == 0:
+                return True
+        distance = speed * self.direction * self.period
+        z = self.grbl.current_z
+        distance = min(max(distance, self.grbl.min_z - z), self.grbl.max_z - z)
+        # truncate to GRBL's resolution, so rounding can't pass a bound
+        distance = int(distance / MIN_JOG) * MIN_JOG
+        if abs(distance) < MIN_JOG:
+            return True
+        grbl_out = self.grbl.jog_z(distance, feed_rate=abs(speed) * 60)
+        if grbl_out != 'ok\r\n':
+            self.stop_reason = f'jog refused by GRBL controller: {grbl_out!r}'
+            return False
+        self.speed = speed
+        return True
+
+    def run(self, setpoint, duration, callback=None):
+        '''Control load to follow `setpoint` for `duration` seconds
+
+        Args:
+            setpoint (callable): takes time since start (s), returns target load
+            duration (float): length of run (s)
+        Kwargs:
+            callback (callable): called each cycle with (time, load, target, z),
+                eg. TelemetryServer.publish via a lambda
+        Returns:
+            tuple: lists of (times (s), loads, setpoints, z positions (mm),
+                latencies from sample to jog sent (s), cycle overruns)
+                if stopped early (max_load, or a jog refused), the reason is
+                in self.stop_reason
+        '''
+        self.reset()
+        times = []
+        loads = []
+        targets = []
+        z_values = []
+        latencies = []
+        overruns = 0
+
+        start = perf_counter()
+        next_cycle = start
+        last_sample = start
+        try:
+            while True:
+                load = self.hx.get_weight(self.times)
+                sampled = perf_counter()
+                now = sampled - start
+                if now >= duration:
+                    break
+                if load >= self.max_load:
+                    self.stop_reason = f'load of {load} reached max_load'
+                    print(f'Load of {load} reached max_load, stopping')
+                    break
+
+                target = setpoint(now)
+                if not self.jog(self.speed_for(target - load, sampled - last_sample)):
+                    print(f'{self.stop_reason}, stopping')
+                    break
+                latencies.append(perf_counter() - sampled)
+                last_sample = sampled
+
+                times.append(now)
+                loads.append(load)
+                targets.append(target)
+                z_values.append(self.grbl.current_z)
+                if callback is not None:
+                    callback(now, load, target, self.grbl.current_z)
+
+                next_cycle += self.period
+                delay = next_cycle - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+                else:
+                    # don't try to catch up on missed cycles
+                    overruns += 1
+                    next_cycle = perf_counter()
+        finally:
+            self.jog(0)
+
+        return times, loads, targets, z_values, latencies, overruns
+
+    def hold(self, load, duration, **kwargs):
+        '''Hold a constant load for `duration` seconds, see `run`
+        '''
+        return self.run(lambda now: load, duration, **kwargs)
+
+    def ramp(self, load_rate, duration, start_load=None, **kwargs):
+        '''Increase load at `load_rate` (per second) for `duration` seconds, see `run`
+
+        Kwargs:
+            start_load (float): load to ramp from, defaults to the load now
+        '''
+        if start_load is None:
+            start_load = self.hx.get_weight(self.times)
+        return self.run(lambda now: start_load + load_rate * now, duration, **kwargs)
+
+
+def latency_summary(latencies, times):
+    '''Describe loop latency and rate achieved by `LoadController.run`
+
+    Returns:
+        str: summary
+    '''
+    if len(times) < 2:
+        return 'Not enough cycles to summarise'
+    ordered = sorted(latencies)
+    rate = (len(times) - 1) / (times[-1] - times[0])
+    return (f'rate {rate:.1f} Hz, latency mean {1000 * sum(ordered) / len(ordered):.2f} ms, '
+            f'95% {1000 * ordered[int(0.95 * (len(ordered) - 1))]:.2f} ms, '
+            f'max {1000 * ordered[-1]:.2f} ms')
+
+
+if __name__ == '__main__':
+    from hx711 import HX711
+    from simulation import SimulatedGrbl, SimulatedLoadCell
+
+    grbl = SimulatedGrbl(feed_rate=60, response_time=0.002)
+    hx = HX711(5, 6, gpio=SimulatedLoadCell(grbl=grbl, stiffness=100, contact_z=-1))
+    hx.set_reading_format('MSB', 'MSB')
+    hx.set_offset(880000)
+    hx.set_reference_unit(950)
+
+    controller = LoadController(hx, grbl, kp=0.01, ki=0.002)
+    print('Ramping at 20 g/s...')
+    times, loads, targets, z_values, latencies, overruns = controller.ramp(20, 10, start_load=0)
+    print(f'Final load {loads[-1]:.1f} g (target {targets[-1]:.1f} g), overruns {overruns}')
+    print(latency_summary(latencies, times))
+    print('Holding at 200 g...')
+    times, loads, targets, z_values, latencies, overruns = controller.hold(200, 10)
+    print(f'Final load {loads[-1]:.1f} g (target {targets[-1]:.1f} g), overruns {overruns}')
+    print(latency_summary(latencies, times))
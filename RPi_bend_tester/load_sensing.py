@@ -20,6 +20,9 @@ SPACING = 5
 PAUSE = 60
 # time to take average for
 DURATION = 120
+# fraction of each pulse of readings trimmed from each end, corrupt reads are
+# already re-read by HX711.readRawBytes so little needs trimming
+TRIM = 0.1
 # NB: total reading duration will be PAUSE + DURATION for each reading
 
 
@@ -54,7 +57,8 @@ try:
     tare_value, tare_pause_values, tare_values = hx.tare(times=TIMES,
                                                          duration=DURATION,
                                                          spacing=SPACING,
-                                                         pause=PAUSE
+                                                         pause=PAUSE,
+                                                         trim=TRIM
                                                         )
 except (KeyboardInterrupt, SystemExit):
     cleanAndExit()
@@ -88,7 +92,8 @@ try:
     cal_value, cal_pause_values, cal_values = hx.read_pulse_average(times=TIMES,
                                                                     duration=DURATION,
                                                                     spacing=SPACING,
-                                                                    pause=PAUSE
+                                                                    pause=PAUSE,
+                                                                    trim=TRIM
                                                                     )
 except (KeyboardInterrupt, SystemExit):
     cleanAndExit()
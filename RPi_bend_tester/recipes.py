@@ -0,0 +1,426 @@
+'''Compile and run bend tests described by a recipe file.
+
+A recipe is a JSON or TOML file (see example_recipes/) such as:
+{
+    "name": "3 point bend",
+    "sample_rate": 10,
+    "times": 3,
+    "abort": {"min_load": -50000, "max_load": 50000},
+    "output": {"path": "{name} {date}.csv", "format": "csv"},
+    "steps": [
+        {"type": "tare", "times": 15, "duration": 120, "spacing": 5, "pause": 60},
+        {"type": "settle", "duration": 10},
+        {"type": "move", "z": -5, "feed_rate": 10},
+        {"type": "hold", "duration": 60, "sample_rate": 2},
+        {"type": "move", "z": 0}
+    ]
+}
+
+Step types:
+    tare: tare the balance with HX711.tare (only allowed as the first step)
+        takes `times`, `duration`, `spacing` and `pause` as HX711.tare does
+    settle: wait for `duration` seconds without moving or sampling
+    move: move to absolute position `z` (mm) at `feed_rate` (mm/min),
+        sampling at `sample_rate` (Hz) on the way
+    hold: stay still for `duration` seconds, sampling at `sample_rate` (Hz)
+`sample_rate` and `times` default to the values at the top of the recipe.
+Each sample is found with HX711.get_weight(times).
+
+`compile_recipe` checks a recipe against the bounds of a GrblSerial and works
+out every G-code and sample time before the test starts, so `run_plan` only
+has to step through a flat list of events. Pass a TelemetryServer to
+`run_plan` (or `run_batch`) to watch a test live.
+'''
+from datetime import datetime
+from decimal import Decimal
+import csv
+import json
+import os
+from time import sleep, time
+
+# HX711 output data rate with RATE pin high (Hz)
+MAX_SAMPLE_RATE = 80
+
+# event kinds in a compiled TestPlan
+GCODE = 0
+SAMPLE = 1
+STEP = 2
+
+# defaults for a tare step, as in load_sensing.py
+TARE_DEFAULTS = {'times': 15, 'duration': 120, 'spacing': 5, 'pause': 60}
+# furthest Z can be from 0 (mm) for the GRBL controller to count as home
+HOME_TOLERANCE = 0.01
+
+
+class TestPlan:
+    '''Bend test compiled from a recipe, ready to be run by `run_plan`.
+
+    Attributes:
+        name (str): name of the test
+        tare (dict/None): kwargs for HX711.tare, None to skip tare
+        times (int): readings averaged for each sample
+        abort (tuple): (min_load, max_load), test is stopped outside these
+        output (dict): 'path' and 'format' of output file, path is None for no file
+        gcode (list[str]): every G-code sent during the test, in order
+        events (list[tuple]): (time (s), kind, payload) for each event, in order
+            kind GCODE: payload is the G-code to send
+            kind SAMPLE: payload is the planned Z position (mm) at that time
+            kind STEP: payload is (step type, planned Z position (mm)) as a
+                settle, move or hold step starts
+        duration (float): time from first event to end of test (s)
+        end_z (float): Z position (mm) at the end of the test
+    '''
+    def __init__(self, name, tare, times, abort, output, events, duration, end_z):
+        self.name = name
+        self.tare = tare
+        self.times = times
+        self.abort = abort
+        self.output = output
+        self.events = events
+        self.gcode = [payload for _, kind, payload in events if kind == GCODE]
+        self.duration = duration
+        self.end_z = end_z
+
+    def sample_count(self):
+        return sum(1 for _, kind, _ in self.events if kind == SAMPLE)
+
+
+def load_recipe(path):
+    '''Load a recipe from a .json or .toml file
+
+    Args:
+        path (str): path of recipe file
+    Returns:
+        dict: recipe
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path) as recipe_file:
+            return json.load(recipe_file)
+    if extension == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            raise ImportError('TOML recipes need Python 3.11+ (tomllib), use JSON instead')
+        with open(path, 'rb') as recipe_file:
+            return tomllib.load(recipe_file)
+    raise ValueError(f'Recipe must be a .json or .toml file, not {path}')
+
+
+def compile_recipe(recipe, min_z=-20, max_z=0, feed_rate=10, start_z=0):
+    '''Check a recipe and work out all G-codes and sample times
+
+    Bounds default to those of GrblSerial, use `compile_for` to take them from
+    an open GrblSerial.
+
+    Args:
+        recipe (dict): recipe, eg. from `load_recipe`
+    Kwargs:
+        min_z (int/float/Decimal): lowest Z position allowed (mm)
+        max_z (int/float/Decimal): highest Z position allowed (mm)
+        feed_rate (int/float/Decimal): fastest feed rate allowed (mm/min)
+        start_z (int/float/Decimal): Z position at start of test (mm)
+    Returns:
+        TestPlan: compiled test
+    '''
+    def is_number(var, var_name):
+        '''Raise an error if `var` if not an int/float/Decimal
+        '''
+        if isinstance(var, bool) or not isinstance(var, (int, float, Decimal)):
+            raise TypeError(f'{var_name} must be an int/float/Decimal, not {type(var)}')
+
+    def check_rate(sample_rate, times, where):
+        '''Raise an error if the HX711 can't keep up with `sample_rate`
+        '''
+        is_number(sample_rate, f'{where} sample_rate')
+        if sample_rate < 0:
+            raise ValueError(f'{where} sample_rate must not be negative, not {sample_rate}')
+        if sample_rate * times > MAX_SAMPLE_RATE:
+            raise ValueError(f'{where} sample_rate of {sample_rate} Hz with times={times} '
+                             f'needs more than {MAX_SAMPLE_RATE} readings/s')
+
+    def sample_times(start, duration, sample_rate):
+        '''Times of samples from `start` (inclusive) to `start + duration` (exclusive)
+        '''
+        if sample_rate == 0:
+            return []
+        count = int(duration * sample_rate)
+        if count < duration * sample_rate:
+            count += 1
+        return [start + i / sample_rate for i in range(count)]
+
+    if not isinstance(recipe, dict):
+        raise TypeError(f'recipe must be a dict, not {type(recipe)}')
+    unknown = set(recipe) - {'name', 'sample_rate', 'times', 'abort', 'output', 'steps'}
+    if unknown:
+        raise ValueError(f'Unrecognised recipe keys: {sorted(unknown)}')
+
+    name = str(recipe.get('name', 'bend test'))
+    times = recipe.get('times', 1)
+    if not isinstance(times, int) or times < 1:
+        raise ValueError(f'times must be an int of at least 1, not {times}')
+    default_rate = recipe.get('sample_rate', 10)
+    check_rate(default_rate, times, 'recipe')
+
+    abort = recipe.get('abort', {})
+    if not isinstance(abort, dict):
+        raise ValueError(f'abort must be a table of min_load/max_load, not {abort!r}')
+    min_load = abort.get('min_load', float('-inf'))
+    max_load = abort.get('max_load', float('inf'))
+    is_number(min_load, 'abort min_load')
+    is_number(max_load, 'abort max_load')
+    if max_load <= min_load:
+        raise ValueError('abort min_load must be less than max_load')
+
+    output = recipe.get('output', {})
+    if not isinstance(output, dict):
+        raise ValueError(f'output must be a table of path/format, not {output!r}')
+    output = {'path': output.get('path'), 'format': output.get('format', 'csv')}
+    if output['format'] not in ('csv', 'values'):
+        raise ValueError(f"output format must be 'csv' or 'values', not {output['format']}")
+
+    steps = recipe.get('steps')
+    if not steps:
+        raise ValueError('recipe must have at least one step')
+    if not isinstance(steps, list):
+        raise ValueError(f'steps must be a list of steps, not {steps!r}')
+
+    if not min_z <= start_z <= max_z:
+        raise ValueError(f'Start Z value of {start_z} mm is out of bounds')
+    # Decimal bounds from GrblSerial can't be mixed with float times
+    min_z, max_z, feed_rate = float(min_z), float(max_z), float(feed_rate)
+
+    tare = None
+    events = []
+    now = 0
+    z = float(start_z)
+    for number, step in enumerate(steps, 1):
+        where = f'step {number}'
+        if not isinstance(step, dict):
+            raise ValueError(f'{where}: step must be a table with a type, not {step!r}')
+        kind = step.get('type')
+        sample_rate = step.get('sample_rate', default_rate)
+        check_rate(sample_rate, times, where)
+
+        if kind == 'tare':
+            if number != 1:
+                raise ValueError(f'{where}: tare must be the first step')
+            unknown = set(step) - {'type', *TARE_DEFAULTS}
+            if unknown:
+                raise ValueError(f'{where}: unrecognised tare keys: {sorted(unknown)}')
+            tare = {key: step.get(key, default) for key, default in TARE_DEFAULTS.items()}
+            for key, value in tare.items():
+                if not isinstance(value, int) or value < 1:
+                    raise ValueError(f'{where}: tare {key} must be an int of at least 1, not {value}')
+
+        elif kind in ('settle', 'hold'):
+            duration = step.get('duration')
+            is_number(duration, f'{where} duration')
+            duration = float(duration)
+            if duration <= 0:
+                raise ValueError(f'{where}: duration must be positive, not {duration}')
+            events.append((now, STEP, (kind, z)))
+            if kind == 'hold':
+                events.extend((t, SAMPLE, z) for t in sample_times(now, duration, sample_rate))
+            now += duration
+
+        elif kind == 'move':
+            new_z = step.get('z')
+            is_number(new_z, f'{where} z')
+            new_z = float(new_z)
+            if not min_z <= new_z <= max_z:
+                raise ValueError(f'{where}: Z value of {new_z} mm is out of bounds')
+            step_feed_rate = step.get('feed_rate', feed_rate)
+            is_number(step_feed_rate, f'{where} feed_rate')
+            step_feed_rate = float(step_feed_rate)
+            if not 0 < step_feed_rate <= feed_rate:
+                raise ValueError(f'{where}: feed_rate must be between 0 and {feed_rate}, not {step_feed_rate}')
+            duration = 60 * abs(new_z - z) / step_feed_rate
+            events.append((now, STEP, (kind, z)))
+            events.append((now, GCODE, f'G01 Z {new_z:.2f} F{step_feed_rate:g}'))
+            events.extend((t, SAMPLE, z + (new_z - z) * (t - now) / duration)
+                          for t in sample_times(now, duration, sample_rate))
+            now += duration
+            z = new_z
+
+        else:
+            raise ValueError(f'{where}: unrecognised step type {kind}')
+
+    # put feed rate back to the one GrblSerial.move_to_z assumes
+    if any(kind == GCODE for _, kind, _ in events):
+        events.append((now, GCODE, f'F{feed_rate:g}'))
+
+    return TestPlan(name, tare, times, (min_load, max_load), output, events, now, z)
+
+
+def compile_for(recipe, grbl):
+    '''Compile a recipe using the bounds of an open GrblSerial
+
+    Args:
+        recipe (dict): recipe, eg. from `load_recipe`
+        grbl (GrblSerial): controller the test will be run on
+    Returns:
+        TestPlan: compiled test
+    '''
+    return compile_recipe(recipe, min_z=grbl.min_z, max_z=grbl.max_z,
+                          feed_rate=grbl.feed_rate, start_z=grbl.current_z)
+
+
+def run_plan(plan, hx, grbl, telemetry=None):
+    '''Run a compiled test
+
+    Tares first if the plan has a tare step, then sends each G-code and takes
+    each sample at its planned time. Stops the GRBL controller and flushes its
+    queued moves (GrblSerial.cancel) if a sample is outside the abort limits
+    or the controller doesn't accept a G-code (eg. 'error:9' in an alarm),
+    leaving grbl.current_z at the position it stopped at.
+
+    With `telemetry`, the test is recorded as a run, and each sample is
+    published with the type of its step as the state. A sample is also
+    published as each step starts, with the last value (NaN before the
+    first), so states without samples (tare, settle) are seen too, and at
+    the end with state 'done' or 'aborted'.
+
+    Args:
+        plan (TestPlan): compiled test, eg. from `compile_for`
+        hx (HX711): load cell amplifier
+        grbl (GrblSerial): controller, at the plan's start position
+    Kwargs:
+        telemetry (TelemetryServer): server to publish samples to
+    Returns:
+        tuple: (sample times (s), planned Z positions (mm), sample values, abort reason or None)
+    '''
+    last_value = float('nan')
+    if telemetry is not None:
+        telemetry.start_run(plan.name, duration=plan.duration,
+                            planned_samples=plan.sample_count())
+
+    if plan.tare is not None:
+        if telemetry is not None:
+            telemetry.publish(last_value, grbl.current_z, 'tare')
+        hx.tare(**plan.tare)
+
+    min_load, max_load = plan.abort
+    times = plan.times
+    sample_times = []
+    z_values = []
+    values = []
+    abort_reason = None
+
+    state = 'idle'
+    start = time()
+    for when, kind, payload in plan.events:
+        delay = start + when - time()
+        if delay > 0:
+            sleep(delay)
+        if kind == STEP:
+            state, z = payload
+            if telemetry is not None:
+                telemetry.publish(last_value, z, state)
+        elif kind == SAMPLE:
+            value = hx.get_weight(times)
+            sample_times.append(time() - start)
+            z_values.append(payload)
+            values.append(value)
+            last_value = value
+            if telemetry is not None:
+                telemetry.publish(value, payload, state)
+            if not min_load <= value <= max_load:
+                abort_reason = f'load of {value} outside abort limits {plan.abort}'
+                grbl.cancel()
+                break
+        else:
+            grbl_out = grbl.write_gcode(payload)
+            if grbl_out != 'ok\r\n':
+                abort_reason = f'GRBL controller replied {grbl_out!r} to {payload}'
+                grbl.cancel()
+                break
+
+    if abort_reason is None:
+        # wait for the last movement to finish
+        delay = start + plan.duration - time()
+        if delay > 0:
+            sleep(delay)
+        grbl.current_z = plan.end_z
+    else:
+        print(f'Test aborted: {abort_reason}')
+
+    if telemetry is not None:
+        if abort_reason is None:
+            telemetry.publish(last_value, grbl.current_z, 'done')
+            telemetry.end_run('done')
+        else:
+            telemetry.publish(last_value, grbl.current_z, 'aborted')
+            telemetry.end_run('aborted', reason=abort_reason)
+
+    if plan.output['path'] is not None:
+        write_output(plan, sample_times, z_values, values)
+
+    return sample_times, z_values, values, abort_reason
+
+
+def write_output(plan, sample_times, z_values, values):
+    '''Write results of a test to the plan's output file
+
+    `{name}` and `{date}` in the output path are filled in.
+    Format 'csv' writes time, z and value columns with a header,
+    'values' writes one value per line (as the existing capture files).
+    '''
+    path = plan.output['path'].format(name=plan.name,
+                                      date=datetime.now().strftime('%Y-%m-%d %H-%M-%S'))
+    with open(path, 'w', newline='') as output_file:
+        if plan.output['format'] == 'values':
+            output_file.writelines(f'{value}\n' for value in values)
+        else:
+            writer = csv.writer(output_file)
+            writer.writerow(('time', 'z', 'value'))
+            writer.writerows(zip(sample_times, z_values, values))
+    return path
+
+
+def run_batch(paths, hx, grbl, telemetry=None):
+    '''Run several recipes one after another without prompting
+
+    Every recipe is compiled before the first test starts, so a bad recipe
+    can't stop a batch part way through. The GRBL controller is sent home
+    (GrblSerial.go_m_home) after each test, and each test only starts once
+    it has stopped there (see `wait_home`).
+
+    Args:
+        paths (iterable): paths of recipe files
+        hx (HX711): load cell amplifier
+        grbl (GrblSerial): controller, at machine home
+    Kwargs:
+        telemetry (TelemetryServer): server to publish samples to, see `run_plan`
+    Returns:
+        list: result of `run_plan` for each recipe
+    '''
+    plans = [compile_recipe(load_recipe(path), min_z=grbl.min_z, max_z=grbl.max_z,
+                            feed_rate=grbl.feed_rate, start_z=0)
+             for path in paths]
+    results = []
+    for plan in plans:
+        wait_home(grbl)
+        print(f'Running {plan.name}...')
+        results.append(run_plan(plan, hx, grbl, telemetry=telemetry))
+        grbl_out = grbl.go_m_home()
+        if grbl_out != 'ok\r\n':
+            raise RuntimeError(f'GRBL controller replied {grbl_out!r} to G28')
+    wait_home(grbl)
+    return results
+
+
+def wait_home(grbl):
+    '''Wait for the GRBL controller to stop, and check it is home
+
+    GrblSerial.go_m_home only sleeps for a fixed time, so the return home can
+    still be under way, eg. after an abort far from home at a slow feed rate.
+
+    Raises:
+        RuntimeError: if not stopped in time, or stopped away from Z 0
+    '''
+    # long enough to come back from the furthest bound at the feed rate
+    timeout = 60 * float(grbl.max_z - grbl.min_z) / float(grbl.feed_rate) + 10
+    grbl.get_position(wait_idle=True, timeout=timeout)
+    if abs(grbl.current_z) > HOME_TOLERANCE:
+        raise RuntimeError(f'GRBL controller stopped at Z {grbl.current_z} mm, not home')
@@ -36,6 +36,8 @@ class GrblSerial(Serial):
         self.busy = False
         # record when last movement should have finished
         self.done_time = time()
+        # Z work coordinate offset (mm), from the WCO field of status reports
+        self.work_offset_z = 0
 
         # find serial port (first matching `serial_port_glob`)
         serial_port = self.find_serial_port(serial_port_glob)
@@ -127,6 +129,98 @@ class GrblSerial(Serial):
             self.current_z = new_z
         return grbl_out
 
+    def jog_z(self, distance, feed_rate=None):
+        '''Jog Z by `distance` mm (incremental) with a GRBL $J= command
+        Only jog if end position is within bounds
+
+        Jogs are queued by GRBL and can be stopped at any time with
+        self.jog_cancel, so they are used for closed-loop control.
+
+        Args:
+            distance (int/float): distance to move (mm), negative is down
+        Kwargs:
+            feed_rate (int/float): feed rate (mm/min), defaults to self.feed_rate
+        Returns:
+            str: response from GRBL controller
+        '''
+        new_z = self.current_z + distance
+        if not self.min_z <= new_z <= self.max_z:
+            print(f'Z value of {new_z} mm is out of bounds')
+            return
+        if feed_rate is None:
+            feed_rate = self.feed_rate
+        grbl_out = self.write_gcode(f'$J=G91 G21 Z{distance:.3f} F{feed_rate:.1f}')
+        if grbl_out == 'ok\r\n':
+            self.current_z = new_z
+        return grbl_out
+
+    def jog_cancel(self):
+        '''Stop any jog in progress and flush queued jogs
+        Uses GRBL's jog cancel real-time command, which gets no response
+
+        self.current_z will be wrong afterwards, use self.get_position(wait_idle=True)
+        '''
+        self.write(b'\x85')
+
+    def status(self):
+        '''Read a GRBL status report
+
+        Positions are converted to work coordinates (as G-code uses), as
+        GRBL reports machine positions by default.
+
+        Returns:
+            tuple: (state, eg. 'Idle', 'Jog' or 'Hold:0', Z position (mm))
+        '''
+        # status report is a real-time command, so no '\n' needed
+        self.write(b'?')
+        # eg. '<Idle|MPos:0.000,0.000,-1.000|FS:0,0>\r\n'
+        # skip any other lines, eg. 'ok' left from earlier G-code
+        status = self.readline().decode('utf-8')
+        while status and not status.startswith('<'):
+            status = self.readline().decode('utf-8')
+        fields = status.strip('<>\r\n').split('|')
+        machine_z = None
+        work_z = None
+        for field in fields[1:]:
+            name, _, values = field.partition(':')
+            if name in ('MPos', 'WPos', 'WCO'):
+                z = float(values.split(',')[2])
+            if name == 'MPos':
+                machine_z = z
+            elif name == 'WPos':
+                work_z = z
+            elif name == 'WCO':
+                # only sent every few reports, and on the next report after
+                # the offset changes (eg. G10 in self.initialize)
+                self.work_offset_z = z
+        if work_z is not None:
+            return fields[0], work_z
+        if machine_z is not None:
+            return fields[0], machine_z - self.work_offset_z
+        raise RuntimeError(f'No position in GRBL status report: {status}')
+
+    def get_position(self, wait_idle=False, timeout=10):
+        '''Find actual Z position from a GRBL status report
+        Sets self.current_z to the position found
+
+        Kwargs:
+            wait_idle (bool): poll until GRBL is idle first, eg. after
+                self.jog_cancel, which decelerates before stopping
+            timeout (float): longest time to wait for idle (s)
+        Returns:
+            float: Z position (mm)
+        '''
+        state, self.current_z = self.status()
+        end = time() + timeout
+        while wait_idle and state != 'Idle':
+            if state == 'Alarm':
+                raise RuntimeError('GRBL controller in alarm state, clear it with $X')
+            if time() > end:
+                raise RuntimeError(f'GRBL controller not idle after {timeout} s ({state})')
+            sleep(0.01)
+            state, self.current_z = self.status()
+        return self.current_z
+
     def go_m_home(self, buffer_time=1):
         '''Go to machine home, sleep until there
         Useful for recalibrating self.current_z
@@ -146,7 +240,33 @@ class GrblSerial(Serial):
         self.close()
         print('Serial port safely closed')
 
-    def cancel(self):
-        '''Brings GRBL to controlled stop
+    def cancel(self, timeout=10):
+        '''Brings GRBL to controlled stop and flushes queued moves
+
+        A feed hold ('!') decelerates without losing position, but keeps the
+        moves queued, so a soft reset (0x18) then flushes them. Resetting
+        clears G90/G21/feed rate, so they are sent again, and
+        self.current_z is found from GRBL.
+
+        Kwargs:
+            timeout (float): longest time to wait for the hold to stop (s)
+        Returns:
+            float: Z position (mm)
         '''
-        return self.write_gcode('$!', busy_check=False)
+        self.write(b'!')
+        end = time() + timeout
+        # motion has already stopped in an alarm
+        while self.status()[0] not in ('Hold:0', 'Idle', 'Alarm'):
+            if time() > end:
+                raise RuntimeError('GRBL controller did not stop')
+            sleep(0.01)
+        self.write(b'\x18')
+        # wait for GRBL to restart, flush its welcome message
+        sleep(1)
+        self.reset_input_buffer()
+        self.write_gcode('G90', busy_check=False)
+        self.write_gcode('G21', busy_check=False)
+        self.write_gcode(f'F{self.feed_rate}', busy_check=False)
+        self.write_gcode('G54', busy_check=False)
+        self.done_time = time()
+        return self.get_position()
@@ -0,0 +1,378 @@
+'''Simulated GRBL controller and HX711 load cell, for running without hardware.
+
+`SimulatedGrbl` has the same interface as GrblSerial, moving Z in real time
+at the feed rate. `SimulatedLoadCell` emulates the HX711's pins, so it is
+used as the GPIO backend of a real HX711:
+>>> grbl = SimulatedGrbl()
+>>> hx = HX711(5, 6, gpio=SimulatedLoadCell(grbl=grbl))
+
+By default the load cell is a spring, loaded once Z goes below `contact_z`.
+'''
+from collections import deque
+from random import gauss
+import re
+from time import sleep, time
+
+
+class SimulatedGrbl:
+    '''Stand-in for GrblSerial, with no serial port.
+
+    Moves and jogs are queued and run one after another, as in GRBL's
+    planner, at constant speed. Stopping (feed hold or jog cancel)
+    decelerates at `acceleration`. Real-time commands written with `write`
+    act as on GRBL:
+        b'!' feed hold: decelerate to a stop, keeping queued moves
+        b'~' cycle start: carry on after a feed hold
+        b'\x18' soft reset: stop and flush queued moves (alarm if moving)
+        b'\x85' jog cancel: decelerate to a stop and flush queued moves
+    Kwargs are as GrblSerial, plus:
+        response_time (float): time taken to respond to each G-code (s),
+            to model the serial round trip
+        acceleration (float): deceleration when stopping (mm/s^2)
+    '''
+    def __init__(self, serial_port_glob=None, baudrate=115200,
+                 min_z=-20, max_z=0, feed_rate=10, response_time=0, acceleration=10):
+        if max_z <= min_z:
+            raise ValueError('min_z must be less than max_z')
+        if not 0 < feed_rate <= 100:
+            raise ValueError(f'feed_rate must be between 0 and 100, not {feed_rate}')
+        self.min_z = min_z
+        self.max_z = max_z
+        self.feed_rate = feed_rate
+        self.current_z = 0
+        self.busy = False
+        self.done_time = time()
+        # modal feed rate (mm/min) used by G01, None after a soft reset
+        self.modal_feed_rate = feed_rate
+        self.response_time = response_time
+        self.acceleration = acceleration
+        # current straight line move: start time, start z, end z, speed (mm/s)
+        self.move = (time(), 0.0, 0.0, 1.0)
+        # queued moves: (end z, speed (mm/s))
+        self.planned = deque()
+        # in a feed hold, queued moves wait for cycle start
+        self.held = False
+        self.alarm = False
+        self.gcode_log = []
+
+    def position(self):
+        '''Actual Z position (mm) now, part way through any move
+        '''
+        now = time()
+        start_time, start_z, end_z, speed = self.move
+        # start queued moves once the current one has finished
+        while self.planned and not self.held:
+            finish_time = start_time + abs(end_z - start_z) / speed
+            if finish_time > now:
+                break
+            start_time, start_z = finish_time, end_z
+            end_z, speed = self.planned.popleft()
+            self.move = start_time, start_z, end_z, speed
+        travelled = (now - start_time) * speed
+        if travelled >= abs(end_z - start_z):
+            return end_z
+        if end_z < start_z:
+            return start_z - travelled
+        return start_z + travelled
+
+    def moving(self):
+        '''Whether Z is moving now
+        '''
+        z = self.position()
+        return z != self.move[2] or (bool(self.planned) and not self.held)
+
+    def state(self):
+        '''Machine state, as in a GRBL status report, eg. 'Idle'
+        '''
+        if self.alarm:
+            return 'Alarm'
+        if self.held:
+            return 'Hold:1' if self.moving() else 'Hold:0'
+        if self.moving():
+            return 'Run'
+        return 'Idle'
+
+    def stop_now(self):
+        '''Stop where we are, with no deceleration
+        '''
+        self.move = (time(), self.position(), self.position(), 1.0)
+
+    def decelerate(self):
+        '''Replace the current move with a stop at `acceleration`
+
+        Returns:
+            tuple: (end z, speed (mm/s)) of the rest of the interrupted move,
+                or None if it finishes while decelerating
+        '''
+        z = self.position()
+        _, start_z, end_z, speed = self.move
+        if z == end_z:
+            return None
+        direction = 1 if end_z > start_z else -1
+        stop_distance = speed**2 / (2 * self.acceleration)
+        if abs(end_z - z) <= stop_distance:
+            return None
+        # same stopping time and distance as constant deceleration
+        self.move = (time(), z, z + direction * stop_distance, speed / 2)
+        return end_z, speed
+
+    def write(self, data):
+        '''Act on real-time commands, as a GRBL controller would
+        '''
+        for byte in data:
+            if byte == ord('!') and not self.held and self.moving():
+                rest = self.decelerate()
+                if rest is not None:
+                    self.planned.appendleft(rest)
+                self.held = True
+            elif byte == ord('~') and self.held:
+                self.position()
+                # queued moves start from now, not from when the hold began
+                if not self.moving():
+                    self.stop_now()
+                self.held = False
+            elif byte == 0x18:
+                # resetting while moving loses position, so GRBL alarms
+                if self.moving() and not self.held:
+                    self.alarm = True
+                self.stop_now()
+                self.planned.clear()
+                self.held = False
+                self.modal_feed_rate = None
+            elif byte == 0x85 and not self.held:
+                self.position()
+                self.planned.clear()
+                self.decelerate()
+
+    def write_gcode(self, gcode, busy_check=True):
+        '''Act on G-code as a GRBL controller would
+
+        Returns:
+            str: response as from GRBL controller, eg. 'ok\\r\\n'
+        '''
+        if self.busy:
+            return 'busy\r\n'
+        if self.response_time:
+            sleep(self.response_time)
+        self.gcode_log.append(gcode)
+        upper = gcode.upper()
+        words = dict(re.findall(r'([A-Z])\s*(-?[\d.]*)', upper))
+        if upper == '$X':
+            self.alarm = False
+            return 'ok\r\n'
+        if upper.startswith('$') and not upper.startswith('$J='):
+            # invalid statement
+            return 'error:3\r\n'
+        if self.alarm:
+            # G-code is locked out until alarm is cleared
+            return 'error:9\r\n'
+        if upper.startswith('$J='):
+            # jog, incremental if G91 is given
+            jog_words = re.findall(r'([A-Z])\s*(-?[\d.]*)', upper[3:])
+            incremental = ('G', '91') in jog_words
+            jog_words = dict(jog_words)
+            if 'Z' not in jog_words or float(jog_words.get('F', 0)) <= 0:
+                return 'error:2\r\n'
+            new_z = float(jog_words['Z'])
+            if incremental:
+                new_z += self.planned_z()
+            self.queue_move(new_z, float(jog_words['F']))
+        elif words.get('G') in ('1', '01'):
+            if 'F' in words:
+                self.modal_feed_rate = float(words['F'])
+            if self.modal_feed_rate is None:
+                # undefined feed rate
+                return 'error:22\r\n'
+            if 'Z' in words:
+                self.queue_move(float(words['Z']), self.modal_feed_rate)
+        elif words.get('G') == '28':
+            self.queue_move(0, self.modal_feed_rate or self.feed_rate)
+        elif 'F' in words:
+            self.modal_feed_rate = float(words['F'])
+        return 'ok\r\n'
+
+    def queue_move(self, new_z, feed_rate):
+        '''Queue a move to `new_z`, after any moves already queued
+        '''
+        if not self.moving() and not self.planned:
+            # idle, so start now
+            self.move = (time(), self.position(), float(new_z), feed_rate / 60)
+        else:
+            self.planned.append((float(new_z), feed_rate / 60))
+
+    def planned_z(self):
+        '''Z position (mm) once all queued moves are done
+        '''
+        if self.planned:
+            return self.planned[-1][0]
+        return self.move[2]
+
+    def move_to_z(self, new_z):
+        '''Move to a new Z position, as GrblSerial.move_to_z
+        '''
+        if not self.min_z <= new_z <= self.max_z:
+            print(f'Z value of {new_z} mm is out of bounds')
+            return
+        if time() < self.done_time:
+            print('Previous Z movement not yet complete')
+            return
+        grbl_out = self.write_gcode(f'G01 Z {new_z:.2f}')
+        if grbl_out == 'ok\r\n':
+            execution_time = 60 * abs(self.current_z - new_z) / self.feed_rate
+            self.done_time = time() + execution_time
+            self.current_z = new_z
+        return grbl_out
+
+    def jog_z(self, distance, feed_rate=None):
+        '''Jog Z by `distance` mm (incremental), as GrblSerial.jog_z
+        '''
+        new_z = self.current_z + distance
+        if not self.min_z <= new_z <= self.max_z:
+            print(f'Z value of {new_z} mm is out of bounds')
+            return
+        if feed_rate is None:
+            feed_rate = self.feed_rate
+        grbl_out = self.write_gcode(f'$J=G91 G21 Z{distance:.3f} F{feed_rate:.1f}')
+        if grbl_out == 'ok\r\n':
+            self.current_z = new_z
+        return grbl_out
+
+    def jog_cancel(self):
+        self.write(b'\x85')
+
+    def status(self):
+        '''Machine state and Z position, as GrblSerial.status
+        '''
+        if self.response_time:
+            sleep(self.response_time)
+        return self.state(), self.position()
+
+    def get_position(self, wait_idle=False, timeout=10):
+        '''Actual Z position, as GrblSerial.get_position
+        '''
+        state, self.current_z = self.status()
+        end = time() + timeout
+        while wait_idle and state != 'Idle':
+            if state == 'Alarm':
+                raise RuntimeError('GRBL controller in alarm state, clear it with $X')
+            if time() > end:
+                raise RuntimeError(f'GRBL controller not idle after {timeout} s ({state})')
+            sleep(0.01)
+            state, self.current_z = self.status()
+        return self.current_z
+
+    def go_m_home(self, buffer_time=1):
+        grbl_out = self.write_gcode('G28')
+        if grbl_out == 'ok\r\n':
+            self.current_z = 0
+        return grbl_out
+
+    def finish(self):
+        self.go_m_home()
+
+    def close(self):
+        pass
+
+    def cancel(self, timeout=10):
+        '''Stop and flush queued moves, as GrblSerial.cancel
+        '''
+        self.write(b'!')
+        end = time() + timeout
+        # motion has already stopped in an alarm
+        while self.status()[0] not in ('Hold:0', 'Idle', 'Alarm'):
+            if time() > end:
+                raise RuntimeError('GRBL controller did not stop')
+            sleep(0.01)
+        self.write(b'\x18')
+        for gcode in ('G90', 'G21', f'F{self.feed_rate}', 'G54'):
+            self.write_gcode(gcode)
+        self.done_time = time()
+        return self.get_position()
+
+
+class SimulatedLoadCell:
+    '''Emulates the pins of an HX711 with a load cell attached.
+
+    Use as the `gpio` backend of HX711. A new conversion is ready every
+    1 / `sample_rate` seconds, clocked out MSB first.
+
+    Kwargs:
+        load (callable): returns load now (eg. in g), overrides spring model
+        grbl (SimulatedGrbl): crosshead for spring model
+        stiffness (float): spring model load per mm below `contact_z`
+        contact_z (float): Z position (mm) where specimen is touched
+        counts_per_unit (float): raw counts per unit load (reference unit)
+        offset (int): raw reading at no load
+        noise (float): standard deviation of raw reading noise (counts)
+        sample_rate (float): HX711 output data rate (Hz), 10 or 80
+    '''
+    BCM = 'BCM'
+    IN = 0
+    OUT = 1
+
+    def __init__(self, load=None, grbl=None, stiffness=100.0, contact_z=-1.0,
+                 counts_per_unit=950.0, offset=880000, noise=100.0, sample_rate=80):
+        if load is None and grbl is None:
+            raise ValueError('Either load or grbl must be given')
+        self.load = load
+        self.grbl = grbl
+        self.stiffness = stiffness
+        self.contact_z = contact_z
+        self.counts_per_unit = counts_per_unit
+        self.offset = offset
+        self.noise = noise
+        self.period = 1 / sample_rate
+        self.pins = {}
+        self.sck = False
+        # number of PD_SCK pulses into the current word (0 when idle)
+        self.clocked = 0
+        self.word = 0
+        self.ready_at = time()
+
+    def true_load(self):
+        '''Load on the cell now, without noise
+        '''
+        if self.load is not None:
+            return self.load()
+        return self.stiffness * max(0.0, self.contact_z - self.grbl.position())
+
+    def convert(self):
+        '''Raw 24 bit word for the load now
+        '''
+        raw = round(self.offset + self.counts_per_unit * self.true_load() + gauss(0, self.noise))
+        raw = max(-0x800000, min(0x7fffff, raw))
+        return raw & 0xffffff
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, channel, direction):
+        self.pins[direction] = channel
+
+    def output(self, channel, value):
+        rising = value and not self.sck
+        self.sck = bool(value)
+        if not rising:
+            return
+        if self.clocked == 0:
+            if time() < self.ready_at:
+                # clocking while no conversion is ready does nothing
+                return
+            self.word = self.convert()
+            self.ready_at = time() + self.period
+        self.clocked += 1
+
+    def input(self, channel):
+        if self.clocked == 0:
+            return 0 if time() >= self.ready_at else 1
+        if self.clocked <= 24:
+            return (self.word >> (24 - self.clocked)) & 1
+        # DOUT is held high after the 25th pulse until the next conversion
+        if time() >= self.ready_at:
+            self.clocked = 0
+            return 0
+        return 1
+
+    def cleanup(self):
+        pass
+
@@ -0,0 +1,430 @@
+'''Stream live test data to browsers on the local network.
+
+`TelemetryServer` runs an HTTP/WebSocket server in a background thread:
+    GET /            live view page
+    GET /runs        JSON list of runs (history)
+    GET /runs/<id>   JSON for one run
+    GET /ws          WebSocket of binary sample frames
+
+Acquisition code calls `publish` for each sample (eg. recipes.run_plan
+with `telemetry=server`). Samples are batched and sent every `interval`
+seconds (if there are any) as one binary frame:
+    header: sequence number (uint32), sample count (uint16)
+    each sample: time (float64, s), force (float32), displacement (float32, mm),
+        state (uint8, index into `states`)
+all little-endian. On connecting, a text frame of JSON gives `states` and
+`interval`.
+
+Each client has a queue of at most `queue_size` frames. If a client falls
+behind, its oldest frames are dropped, so a slow client never holds up
+acquisition or other clients.
+
+Run with simulated devices (see simulation.py) for a demo:
+    python telemetry.py
+then open http://localhost:8765/
+'''
+import asyncio
+from base64 import b64encode
+from hashlib import sha1
+import json
+import struct
+import threading
+from time import time
+
+# GUID used in WebSocket handshake (RFC 6455)
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+HEADER_FORMAT = '<IH'
+SAMPLE_FORMAT = '<dffB'
+# largest number of samples in one frame (sample count is a uint16)
+MAX_BATCH = 0xffff
+
+STATES = ('idle', 'tare', 'settle', 'move', 'hold', 'control', 'aborted', 'done')
+
+PAGE = '''<!DOCTYPE html>
+<html><head><title>RPi bend tester</title></head>
+<body style="font-family: monospace">
+<h1>RPi bend tester</h1>
+<p>State: <span id="state">-</span></p>
+<p>Force: <span id="force">-</span></p>
+<p>Displacement: <span id="z">-</span> mm</p>
+<p>Samples: <span id="count">0</span>, frames: <span id="frames">0</span></p>
+<script>
+let states = [];
+let count = 0, frames = 0;
+const ws = new WebSocket(`ws://${location.host}/ws`);
+ws.binaryType = 'arraybuffer';
+ws.onmessage = (event) => {
+    if (typeof event.data === 'string') {
+        states = JSON.parse(event.data).states;
+        return;
+    }
+    const view = new DataView(event.data);
+    const n = view.getUint16(4, true);
+    frames += 1;
+    count += n;
+    if (n > 0) {
+        const last = 6 + (n - 1) * 17;
+        document.getElementById('force').textContent = view.getFloat32(last + 8, true).toFixed(2);
+        document.getElementById('z').textContent = view.getFloat32(last + 12, true).toFixed(3);
+        document.getElementById('state').textContent = states[view.getUint8(last + 16)];
+    }
+    document.getElementById('count').textContent = count;
+    document.getElementById('frames').textContent = frames;
+};
+</script>
+</body></html>
+'''
+
+
+def pack_frame(sequence, samples):
+    '''Pack samples into a binary frame
+
+    Args:
+        sequence (int): frame number
+        samples (list[tuple]): of (time, force, displacement, state index)
+    Returns:
+        bytes: frame
+    '''
+    sample_struct = struct.Struct(SAMPLE_FORMAT)
+    frame = bytearray(struct.pack(HEADER_FORMAT, sequence & 0xffffffff, len(samples)))
+    for sample in samples:
+        frame += sample_struct.pack(*sample)
+    return bytes(frame)
+
+
+def unpack_frame(frame):
+    '''Unpack a binary frame made by `pack_frame`
+
+    Returns:
+        tuple: (sequence, list of (time, force, displacement, state index))
+    '''
+    header_size = struct.calcsize(HEADER_FORMAT)
+    sequence, count = struct.unpack_from(HEADER_FORMAT, frame)
+    samples = list(struct.iter_unpack(SAMPLE_FORMAT, frame[header_size:]))
+    if len(samples) != count:
+        raise ValueError(f'Frame should have {count} samples, not {len(samples)}')
+    return sequence, samples
+
+
+def websocket_frame(payload, opcode):
+    '''Make an unmasked (server to client) WebSocket frame
+    '''
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 0x10000:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+class Client:
+    '''WebSocket client with a bounded queue of frames to send.
+    '''
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def offer(self, frame):
+        '''Queue `frame`, dropping the oldest queued frame if full
+        '''
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+
+
+class TelemetryServer:
+    '''HTTP/WebSocket server streaming batched samples to local clients.
+
+    Kwargs:
+        host (str): address to listen on, '0.0.0.0' for the whole network
+        port (int): port to listen on, 0 to pick a free port
+        interval (float): time between frames (s)
+        queue_size (int): frames queued per client before dropping
+        states (tuple[str]): names of states that can be published
+    '''
+    def __init__(self, host='127.0.0.1', port=8765, interval=0.05, queue_size=20, states=STATES):
+        if interval <= 0:
+            raise ValueError(f'interval must be positive, not {interval}')
+        if queue_size < 1:
+            raise ValueError(f'queue_size must be at least 1, not {queue_size}')
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.queue_size = queue_size
+        self.states = tuple(states)
+        self.state_indexes = {state: index for index, state in enumerate(self.states)}
+
+        # samples waiting for next frame, filled by `publish`
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.sequence = 0
+        self.clients = set()
+        self.runs = []
+
+        self.loop = None
+        self.thread = None
+        self.started = threading.Event()
+        # error raised by the background thread while starting, if any
+        self.start_error = None
+
+    def publish(self, force, displacement, state, sample_time=None):
+        '''Add a sample to the next frame. Safe to call from any thread.
+
+        Args:
+            force (float): load reading
+            displacement (float): Z position (mm)
+            state (str): one of `self.states`
+        Kwargs:
+            sample_time (float): time of sample (s since epoch), defaults to now
+        '''
+        if sample_time is None:
+            sample_time = time()
+        sample = (sample_time, force, displacement, self.state_indexes[state])
+        with self.pending_lock:
+            self.pending.append(sample)
+        if self.runs and self.runs[-1]['end'] is None:
+            self.runs[-1]['samples'] += 1
+
+    def start_run(self, name, **info):
+        '''Record the start of a run in the run history
+
+        Args:
+            name (str): name of run
+        Kwargs:
+            info: extra JSON serialisable information about the run
+        Returns:
+            int: id of run
+        '''
+        run_id = len(self.runs)
+        self.runs.append({'id': run_id, 'name': name, 'start': time(), 'end': None,
+                          'samples': 0, 'result': None, **info})
+        return run_id
+
+    def end_run(self, result='done', **info):
+        '''Record the end of the current run in the run history
+
+        Kwargs:
+            result (str): how the run ended, eg. 'done' or 'aborted'
+            info: extra JSON serialisable information about the run
+        '''
+        if not self.runs or self.runs[-1]['end'] is not None:
+            raise RuntimeError('No run in progress, use start_run()')
+        self.runs[-1].update(end=time(), result=result, **info)
+
+    def start(self):
+        '''Start serving in a background thread
+
+        Raises:
+            OSError: if the server can't listen on `host` and `port`
+        Returns:
+            int: port being listened on
+        '''
+        if self.thread is not None:
+            raise RuntimeError('Server already started')
+        self.started.clear()
+        self.start_error = None
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.start_error is not None:
+            self.thread.join()
+            self.thread = None
+            raise self.start_error
+        return self.port
+
+    def stop(self):
+        '''Stop serving and wait for the background thread to finish
+        '''
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join()
+        self.thread = None
+
+    def serve(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle, self.host, self.port))
+        except Exception as error:
+            # hand the error to `start`, rather than leaving it waiting
+            self.start_error = error
+            self.loop.close()
+            self.loop = None
+            self.started.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        broadcaster = self.loop.create_task(self.broadcast())
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            # cancel the broadcaster and connection handlers, and let them
+            # finish (closing their sockets) before the loop is closed
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(server.wait_closed())
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+            self.loop = None
+
+    async def broadcast(self):
+        '''Every `interval`, send pending samples to all clients as one frame
+        '''
+        while True:
+            await asyncio.sleep(self.interval)
+            with self.pending_lock:
+                samples, self.pending = self.pending, []
+            # split up if too many samples have built up for one frame
+            for start in range(0, len(samples), MAX_BATCH):
+                frame = websocket_frame(pack_frame(self.sequence, samples[start:start + MAX_BATCH]), 0x2)
+                self.sequence += 1
+                for client in self.clients:
+                    client.offer(frame)
+
+    async def handle(self, reader, writer):
+        '''Handle an HTTP request, upgrading to a WebSocket for /ws
+        '''
+        try:
+            await self.route(reader, writer)
+        except asyncio.CancelledError:
+            # cancelled by `stop`: end normally, as before Python 3.12 the
+            # stream's done callback raises for a cancelled handler
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, reader, writer):
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return
+        lines = request.decode('latin-1').split('\r\n')
+        try:
+            method, path, _ = lines[0].split(' ', 2)
+        except ValueError:
+            await self.respond(writer, 400, 'text/plain', b'Bad request')
+            return
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+
+        if method != 'GET':
+            await self.respond(writer, 405, 'text/plain', b'Method not allowed')
+        elif path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+            await self.websocket(reader, writer, headers)
+        elif path == '/':
+            await self.respond(writer, 200, 'text/html', PAGE.encode('utf-8'))
+        elif path == '/runs':
+            await self.respond(writer, 200, 'application/json', json.dumps(self.runs).encode('utf-8'))
+        elif path.startswith('/runs/') and path[6:].isdigit() and int(path[6:]) < len(self.runs):
+            run = self.runs[int(path[6:])]
+            await self.respond(writer, 200, 'application/json', json.dumps(run).encode('utf-8'))
+        else:
+            await self.respond(writer, 404, 'text/plain', b'Not found')
+
+    async def respond(self, writer, status, content_type, body):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+        writer.write((f'HTTP/1.1 {status} {reasons[status]}\r\n'
+                      f'Content-Type: {content_type}\r\n'
+                      f'Content-Length: {len(body)}\r\n'
+                      'Connection: close\r\n\r\n').encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def websocket(self, reader, writer, headers):
+        '''Complete the WebSocket handshake, then send queued frames
+        '''
+        key = headers.get('sec-websocket-key')
+        if key is None:
+            await self.respond(writer, 400, 'text/plain', b'Missing Sec-WebSocket-Key')
+            return
+        accept = b64encode(sha1((key + WEBSOCKET_GUID).encode('latin-1')).digest()).decode('latin-1')
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\n'
+                      'Upgrade: websocket\r\n'
+                      'Connection: Upgrade\r\n'
+                      f'Sec-WebSocket-Accept: {accept}\r\n\r\n').encode('latin-1'))
+        hello = json.dumps({'states': self.states, 'interval': self.interval})
+        writer.write(websocket_frame(hello.encode('utf-8'), 0x1))
+
+        client = Client(writer, self.queue_size)
+        self.clients.add(client)
+        receiver = asyncio.ensure_future(self.receive(reader, client))
+        try:
+            while not receiver.done():
+                getter = asyncio.ensure_future(client.queue.get())
+                done, _ = await asyncio.wait((getter, receiver), return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                writer.write(getter.result())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            receiver.cancel()
+            writer.close()
+
+    async def receive(self, reader, client):
+        '''Read frames from a client until it closes, answering pings
+        '''
+        try:
+            while True:
+                first, second = await reader.readexactly(2)
+                opcode = first & 0x0f
+                length = second & 0x7f
+                if length == 126:
+                    length, = struct.unpack('!H', await reader.readexactly(2))
+                elif length == 127:
+                    length, = struct.unpack('!Q', await reader.readexactly(8))
+                mask = await reader.readexactly(4) if second & 0x80 else bytes(4)
+                payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(await reader.readexactly(length)))
+                if opcode == 0x8:
+                    client.writer.write(websocket_frame(payload[:2], 0x8))
+                    return
+                if opcode == 0x9:
+                    client.writer.write(websocket_frame(payload, 0xa))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+
+
+if __name__ == '__main__':
+    from time import sleep
+
+    from hx711 import HX711
+    from simulation import SimulatedGrbl, SimulatedLoadCell
+
+    grbl = SimulatedGrbl(feed_rate=60)
+    hx = HX711(5, 6, gpio=SimulatedLoadCell(grbl=grbl))
+    hx.set_reading_format('MSB', 'MSB')
+    hx.set_offset(880000)
+    hx.set_reference_unit(950)
+
+    server = TelemetryServer()
+    print(f'Serving on http://localhost:{server.start()}/')
+    try:
+        while True:
+            server.start_run('simulated bend')
+            for target in (-5, 0):
+                grbl.move_to_z(target)
+                while grbl.position() != target:
+                    server.publish(hx.get_weight(1), grbl.position(), 'move')
+            server.end_run()
+            sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import filters
+from filters import Biquad, Decimate, Kalman, MovingAverage, Pipeline, SinglePoleLowPass
+
+STAGES = {
+    'moving_average': lambda: MovingAverage(8),
+    'single_pole': lambda: SinglePoleLowPass(5, 80),
+    'low_pass': lambda: Biquad.low_pass(10, 80),
+    'notch': lambda: Biquad.notch(50, 80),
+    'decimate': lambda: Decimate(3),
+    'kalman': lambda: Kalman(100.0**2, level_variance=10.0, drift_variance=0.01),
+    'pipeline': lambda: Pipeline(Biquad.notch(50, 80), SinglePoleLowPass(10, 80), Decimate(4)),
+}
+
+
+@pytest.fixture
+def samples():
+    # raw HX711 like readings: large offset, slow drift, noise and mains pickup
+    rng = np.random.default_rng(0)
+    n = np.arange(2000)
+    return (880000 + 0.5 * n + rng.normal(0, 100, len(n))
+            + 50 * np.sin(2 * np.pi * 50 / 80 * n))
+
+
+def stream(stage, values):
+    filtered = (stage.update(value) for value in values)
+    return np.array([value for value in filtered if value is not None])
+
+
+@pytest.fixture(params=[True, False], ids=['scipy', 'python'])
+def batch_backend(request, monkeypatch):
+    if request.param:
+        if filters.lfilter is None:
+            pytest.skip('scipy not installed')
+    else:
+        monkeypatch.setattr(filters, 'lfilter', None)
+
+
+@pytest.mark.parametrize('make', STAGES.values(), ids=STAGES.keys())
+def test_batch_matches_stream(make, samples, batch_backend):
+    expected = stream(make(), samples)
+    np.testing.assert_allclose(make().process(samples), expected, rtol=1e-9)
+
+
+@pytest.mark.parametrize('make', STAGES.values(), ids=STAGES.keys())
+def test_batch_continues_stream(make, samples, batch_backend):
+    expected = stream(make(), samples)
+    stage = make()
+    first = stream(stage, samples[:777])
+    second = stage.process(samples[777:1500])
+    third = stream(stage, samples[1500:])
+    np.testing.assert_allclose(np.concatenate((first, second, third)), expected, rtol=1e-9)
+
+
+def test_kalman_reaches_steady_gains(samples):
+    kalman = STAGES['kalman']()
+    kalman.process(samples)
+    assert kalman.steady_gains is not None
+
+
+def test_reset_forgets_samples(samples):
+    for make in STAGES.values():
+        stage = make()
+        stage.process(samples[:100])
+        stage.reset()
+        np.testing.assert_allclose(stage.process(samples), make().process(samples), rtol=1e-12)
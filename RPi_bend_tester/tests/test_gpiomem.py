@@ -0,0 +1,51 @@
+import struct
+
+from gpiomem import (BLOCK_SIZE, CLEAR_INDEX, GPFSEL0, LEVEL_INDEX, SET_INDEX,
+                     GpioMem, make_stand_in)
+
+
+def read_registers(path):
+    with open(path, 'rb') as stand_in:
+        block = stand_in.read()
+    return struct.unpack(f'{BLOCK_SIZE // 4}I', block)
+
+
+def test_register_round_trip(tmp_path):
+    path = make_stand_in(str(tmp_path / 'gpiomem'))
+    gpio = GpioMem(path)
+    gpio.setmode(gpio.BCM)
+    gpio.setup(6, gpio.OUT)
+    gpio.setup(12, gpio.OUT)
+    gpio.setup(5, gpio.IN)
+
+    gpio.output(6, True)
+    assert gpio.registers[SET_INDEX] == 1 << 6
+    gpio.output(12, False)
+    assert gpio.registers[CLEAR_INDEX] == 1 << 12
+
+    # levels only change when written to GPLEV0 on a stand-in
+    assert gpio.input(5) == 0
+    gpio.registers[LEVEL_INDEX] = 1 << 5
+    assert gpio.input(5) == 1
+    assert gpio.input(6) == 0
+
+    # writes go through to the mapped file
+    registers = read_registers(path)
+    assert (registers[GPFSEL0 // 4] >> 18) & 0b111 == gpio.OUT
+    assert (registers[GPFSEL0 // 4 + 1] >> 6) & 0b111 == gpio.OUT
+    assert registers[LEVEL_INDEX] == 1 << 5
+
+    gpio.cleanup()
+    registers = read_registers(path)
+    assert (registers[GPFSEL0 // 4] >> 18) & 0b111 == GpioMem.IN
+    assert (registers[GPFSEL0 // 4 + 1] >> 6) & 0b111 == GpioMem.IN
+
+
+def test_setup_keeps_other_pins(tmp_path):
+    gpio = GpioMem(make_stand_in(str(tmp_path / 'gpiomem')))
+    gpio.setup(5, gpio.OUT)
+    gpio.setup(6, gpio.OUT)
+    gpio.setup(5, gpio.IN)
+    assert (gpio.registers[0] >> 15) & 0b111 == gpio.IN
+    assert (gpio.registers[0] >> 18) & 0b111 == gpio.OUT
+    gpio.cleanup()
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from graphs import chi_r_2, fit_linear, fit_poly, r_squared, rolling_slope
+
+
+@pytest.fixture
+def datasets():
+    # raw HX711 like readings: large offsets, drift and noise, one run per row
+    rng = np.random.default_rng(1)
+    x = np.linspace(0, 300, 61)
+    y = (880000 + rng.normal(0, 5000, (5, 1)) + rng.normal(0, 2, (5, 1)) * x
+         + 0.001 * x**2 + rng.normal(0, 100, (5, len(x))))
+    y_error = rng.uniform(50, 150, y.shape)
+    return x, y, y_error
+
+
+@pytest.mark.parametrize('degree', [1, 2, 3])
+def test_fit_poly_matches_polyfit(datasets, degree):
+    x, y, y_error = datasets
+    coefficients, covariance = fit_poly(x, y, degree)
+    weighted, weighted_covariance = fit_poly(x, y, degree, y_error=y_error)
+    for i in range(len(y)):
+        expected, expected_covariance = np.polyfit(x, y[i], degree, cov=True)
+        np.testing.assert_allclose(coefficients[i], expected, rtol=1e-6)
+        np.testing.assert_allclose(covariance[i], expected_covariance, rtol=1e-6)
+        expected, expected_covariance = np.polyfit(x, y[i], degree, w=1 / y_error[i],
+                                                   cov='unscaled')
+        np.testing.assert_allclose(weighted[i], expected, rtol=1e-6)
+        np.testing.assert_allclose(weighted_covariance[i], expected_covariance, rtol=1e-6)
+
+
+def test_fit_linear_matches_polyfit(datasets):
+    x, y, y_error = datasets
+    coefficients, covariance = fit_linear(x, y)
+    weighted, weighted_covariance = fit_linear(x, y, y_error=y_error)
+    for i in range(len(y)):
+        expected, expected_covariance = np.polyfit(x, y[i], 1, cov=True)
+        np.testing.assert_allclose(coefficients[i], expected, rtol=1e-9)
+        np.testing.assert_allclose(covariance[i], expected_covariance, rtol=1e-9)
+        expected, expected_covariance = np.polyfit(x, y[i], 1, w=1 / y_error[i], cov='unscaled')
+        np.testing.assert_allclose(weighted[i], expected, rtol=1e-9)
+        np.testing.assert_allclose(weighted_covariance[i], expected_covariance, rtol=1e-9)
+
+    # 1-D input gives 1-D output
+    single, single_covariance = fit_linear(x, y[0])
+    assert single.shape == (2,) and single_covariance.shape == (2, 2)
+    np.testing.assert_allclose(single, coefficients[0], rtol=1e-12)
+
+
+def test_rolling_slope_matches_polyfit(datasets):
+    x, y, _ = datasets
+    window = 10
+    slopes = rolling_slope(x, y, window)
+    assert slopes.shape == (len(y), len(x) - window + 1)
+    for i in range(len(y)):
+        expected = [np.polyfit(x[start:start + window], y[i, start:start + window], 1)[0]
+                    for start in range(len(x) - window + 1)]
+        np.testing.assert_allclose(slopes[i], expected, rtol=1e-6)
+
+
+def test_statistics_per_dataset(datasets):
+    x, y, y_error = datasets
+    coefficients, _ = fit_poly(x, y, 2)
+    fitted = np.array([np.polyval(row, x) for row in coefficients])
+    chi = chi_r_2(y, y_error, fitted, ddof=2)
+    r2 = r_squared(x, y, coefficients)
+    for i in range(len(y)):
+        assert chi[i] == pytest.approx(
+            np.sum(((y[i] - fitted[i]) / y_error[i])**2) / (len(x) - 3))
+        assert r2[i] == pytest.approx(
+            1 - np.sum((y[i] - fitted[i])**2) / np.sum((y[i] - y[i].mean())**2))
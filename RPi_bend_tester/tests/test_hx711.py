@@ -0,0 +1,117 @@
+import threading
+from time import perf_counter, sleep
+
+import pytest
+
+from filters import MovingAverage
+import hx711
+from hx711 import HX711
+from simulation import SimulatedLoadCell
+
+OFFSET = 880000
+
+
+class SlowClockCell(SimulatedLoadCell):
+    '''Load cell whose next `slow_pulses` PD_SCK high phases last 200 us,
+    as if the process was preempted mid-word
+    '''
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.slow_pulses = 0
+
+    def output(self, channel, value):
+        super().output(channel, value)
+        if value and self.slow_pulses:
+            self.slow_pulses -= 1
+            sleep(0.0002)
+
+
+@pytest.fixture
+def hx(monkeypatch):
+    # skip HX711's start up delay
+    monkeypatch.setattr(hx711, 'sleep', lambda seconds: None)
+    hx = HX711(5, 6, gpio=SlowClockCell(load=lambda: 0.0, offset=OFFSET, noise=0))
+    hx.set_reading_format('MSB', 'MSB')
+    hx.invalidReads = 0
+    yield hx
+    hx.set_filter(None)
+
+
+def test_long_pulse_is_retried(hx):
+    hx.gpio.slow_pulses = 1
+    assert hx.read_long() == OFFSET
+    # the test process being preempted mid-word can add a retry of its own
+    assert hx.invalidReads >= 1
+
+
+def test_retries_give_up_and_release_lock(hx):
+    hx.gpio.slow_pulses = 10000
+    with pytest.raises(RuntimeError):
+        hx.read_long()
+    assert hx.invalidReads == hx.MAX_RETRIES + 1
+    assert hx.readLock.acquire(blocking=False)
+    hx.readLock.release()
+
+
+def test_tare_passes_trim(hx, monkeypatch):
+    trims = []
+    monkeypatch.setattr(hx, 'read_average', lambda times, trim: trims.append(trim) or OFFSET)
+    value, _, _ = hx.tare(times=5, duration=2, spacing=1, pause=1, trim=0.1)
+    assert value == OFFSET
+    assert trims == [0.1, 0.1, 0.1]
+    assert hx.get_offset() == OFFSET
+
+
+def test_read_average_trims(hx):
+    values = iter([100, 0, 1, 2, 3, 4, 5, 6, 7, -100])
+    hx.read_long = lambda: next(values)
+    assert hx.read_average(10, trim=0.1) == 3.5
+
+
+def test_acquisition_polls_rather_than_spins(hx, monkeypatch):
+    checks = []
+    is_ready = hx.is_ready
+
+    def counting_is_ready():
+        # only count polls between reads, not readRawWord waiting on a retry
+        if not hx.readLock.locked():
+            checks.append(1)
+        return is_ready()
+
+    monkeypatch.setattr(hx, 'is_ready', counting_is_ready)
+    hx.set_filter(MovingAverage(4))
+    sleep(0.25)
+    hx.stop_acquisition()
+    # about one check per POLL_INTERVAL, a busy wait makes ~100000
+    assert 0 < len(checks) < 2000
+    assert hx.filteredCount > 5
+
+
+def test_acquisition_error_is_raised(hx):
+    hx.set_filter(MovingAverage(4))
+    assert hx.read_filtered() == pytest.approx(OFFSET)
+    hx.gpio.slow_pulses = 10**6
+    start = perf_counter()
+    with pytest.raises(RuntimeError, match='no valid read'):
+        hx.read_filtered(timeout=5)
+    assert perf_counter() - start < 2
+
+
+def test_direct_reads_pause_acquisition(hx, monkeypatch):
+    hx.set_filter(MovingAverage(4))
+    paused = []
+    read_long = hx.read_long
+
+    def checked_read_long():
+        if threading.current_thread() is threading.main_thread():
+            paused.append(hx.acquisitionThread is None)
+        return read_long()
+    monkeypatch.setattr(hx, 'read_long', checked_read_long)
+
+    hx.read_median(3)
+    hx.read_average(5)
+    hx.read_pulse_average(times=1, duration=1, spacing=1, pause=0)
+    assert paused == [True] * 9
+    # restarted afterwards
+    assert hx.acquisitionThread is not None
+    assert hx.read_filtered() == pytest.approx(OFFSET)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import hx711
+from hx711 import HX711
+from load_control import LoadController
+from simulation import SimulatedGrbl, SimulatedLoadCell
+
+
+@pytest.fixture
+def rig(monkeypatch):
+    # skip HX711's start up delay
+    monkeypatch.setattr(hx711, 'sleep', lambda seconds: None)
+    grbl = SimulatedGrbl(feed_rate=60)
+    hx = HX711(5, 6, gpio=SimulatedLoadCell(grbl=grbl, stiffness=100, contact_z=-0.2))
+    hx.set_reading_format('MSB', 'MSB')
+    hx.set_offset(880000)
+    hx.set_reference_unit(950)
+    return hx, grbl
+
+
+def test_hold_settles(rig):
+    hx, grbl = rig
+    controller = LoadController(hx, grbl, kp=0.02, ki=0.005)
+    times, loads, targets, z_values, latencies, overruns = controller.hold(100, 5)
+    times = np.array(times)
+    loads = np.array(loads)
+    assert np.all(np.array(targets) == 100)
+    assert loads.max() < 115
+    assert abs(loads[times > 4].mean() - 100) < 5
+    # jogs are cancelled at the end, and Z found once stopped
+    assert grbl.state() == 'Idle'
+    assert grbl.current_z == pytest.approx(grbl.position())
+
+
+def test_direction_change_resyncs_z(rig):
+    _, grbl = rig
+    controller = LoadController(None, grbl)
+    controller.jog(1.0)
+    controller.jog(1.0)
+    controller.jog(-1.0)
+    # the cancelled jogs decelerated, then a new jog was queued from there
+    stopped_z = grbl.move[1]
+    assert grbl.current_z == pytest.approx(stopped_z + controller.period)
+
+
+def test_refused_jog_stops_run(rig):
+    hx, grbl = rig
+    controller = LoadController(hx, grbl, kp=0.02, ki=0.005)
+    grbl.alarm = True
+    times, *_ = controller.hold(100, 5)
+    # stopped on the first jog, without cancelling a jog never queued
+    assert len(times) == 0
+    assert 'error:9' in controller.stop_reason
+    assert controller.speed == 0
+    assert not any(line.startswith('$J') for line in grbl.gcode_log[1:])
+
+
+def test_refused_jog_keeps_speed(rig):
+    _, grbl = rig
+    controller = LoadController(None, grbl)
+    grbl.busy = True
+    assert not controller.jog(1.0)
+    assert controller.speed == 0
+    assert 'busy' in controller.stop_reason
+
+
+def test_saturated_integral_only_winds_back(rig):
+    _, grbl = rig
+    controller = LoadController(None, grbl, kp=1, ki=1, max_speed=1)
+    controller.integral = 10.0
+    # saturated, and the error drives it further: integral frozen
+    assert controller.speed_for(5, 1) == 1
+    assert controller.integral == 10.0
+    # still saturated, but the error winds the integral back
+    assert controller.speed_for(-1, 1) == 1
+    assert controller.integral == 9.0
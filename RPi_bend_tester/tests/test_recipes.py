@@ -0,0 +1,128 @@
+import json
+import os
+
+import pytest
+
+import hx711
+from hx711 import HX711
+from recipes import GCODE, SAMPLE, STEP, compile_recipe, load_recipe, run_batch, run_plan
+from simulation import SimulatedGrbl, SimulatedLoadCell
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'example_recipes', 'three_point_bend.json')
+
+
+def recipe(**changes):
+    base = {'name': 'test', 'sample_rate': 10, 'times': 1,
+            'steps': [{'type': 'move', 'z': -1, 'feed_rate': 10},
+                      {'type': 'hold', 'duration': 1}]}
+    base.update(changes)
+    return base
+
+
+def test_example_recipe():
+    plan = compile_recipe(load_recipe(EXAMPLE))
+    assert plan.tare == {'times': 15, 'duration': 120, 'spacing': 5, 'pause': 60}
+    assert plan.gcode == ['G01 Z -5.00 F10', 'G01 Z 0.00 F10', 'F10']
+    # settle 10 s, down 30 s, hold 60 s, up 30 s
+    assert plan.duration == 130
+    assert plan.end_z == 0
+    # 10 Hz while moving, 2 Hz holding
+    assert plan.sample_count() == 300 + 120 + 300
+
+
+def test_move_samples_follow_z():
+    plan = compile_recipe(recipe(), start_z=0)
+    samples = [(t, z) for t, kind, z in plan.events if kind == SAMPLE]
+    assert samples[:3] == [(0, 0), (0.1, pytest.approx(-1 / 60)), (0.2, pytest.approx(-2 / 60))]
+    assert samples[-1] == (pytest.approx(6.9), -1)
+    assert plan.events[:2] == [(0, STEP, ('move', 0.0)), (0, GCODE, 'G01 Z -1.00 F10')]
+    assert [payload for _, kind, payload in plan.events if kind == STEP] == \
+        [('move', 0.0), ('hold', -1.0)]
+
+
+@pytest.mark.parametrize('changes, error', [
+    ({'colour': 'red'}, ValueError),
+    ({'times': 0}, ValueError),
+    ({'times': 1.5}, ValueError),
+    ({'sample_rate': 81}, ValueError),
+    ({'sample_rate': 'fast'}, TypeError),
+    ({'times': 9, 'sample_rate': 10}, ValueError),
+    ({'abort': {'min_load': 10, 'max_load': 10}}, ValueError),
+    ({'abort': [0, 100]}, ValueError),
+    ({'abort': {'max_load': '100'}}, TypeError),
+    ({'output': 'out.csv'}, ValueError),
+    ({'output': {'format': 'xlsx'}}, ValueError),
+    ({'steps': []}, ValueError),
+    ({'steps': {'type': 'hold', 'duration': 1}}, ValueError),
+    ({'steps': ['hold']}, ValueError),
+    ({'steps': [{'type': 'jump'}]}, ValueError),
+    ({'steps': [{'type': 'hold', 'duration': 0}]}, ValueError),
+    ({'steps': [{'type': 'hold'}]}, TypeError),
+    ({'steps': [{'type': 'hold', 'duration': 1, 'sample_rate': 100}]}, ValueError),
+    ({'steps': [{'type': 'move', 'z': 1}]}, ValueError),
+    ({'steps': [{'type': 'move', 'z': -21}]}, ValueError),
+    ({'steps': [{'type': 'move', 'z': -1, 'feed_rate': 11}]}, ValueError),
+    ({'steps': [{'type': 'move', 'z': -1, 'feed_rate': 0}]}, ValueError),
+    ({'steps': [{'type': 'hold', 'duration': 1}, {'type': 'tare'}]}, ValueError),
+    ({'steps': [{'type': 'tare', 'seconds': 5}]}, ValueError),
+    ({'steps': [{'type': 'tare', 'times': 0}]}, ValueError),
+])
+def test_invalid_recipes(changes, error):
+    with pytest.raises(error):
+        compile_recipe(recipe(**changes))
+
+
+def test_invalid_recipe_type():
+    with pytest.raises(TypeError):
+        compile_recipe(['steps'])
+
+
+def test_start_out_of_bounds():
+    with pytest.raises(ValueError):
+        compile_recipe(recipe(), start_z=1)
+
+
+@pytest.fixture
+def rig(monkeypatch):
+    # skip HX711's start up delay and tare spacing
+    monkeypatch.setattr(hx711, 'sleep', lambda seconds: None)
+    grbl = SimulatedGrbl(feed_rate=60)
+    hx = HX711(5, 6, gpio=SimulatedLoadCell(grbl=grbl, stiffness=100, contact_z=-0.5, noise=0))
+    hx.set_reading_format('MSB', 'MSB')
+    hx.set_offset(880000)
+    hx.set_reference_unit(950)
+    return hx, grbl
+
+
+def test_gcode_error_aborts(rig):
+    hx, grbl = rig
+    grbl.alarm = True
+    plan = compile_recipe(recipe(), feed_rate=60)
+    sample_times, z_values, values, abort_reason = run_plan(plan, hx, grbl)
+    assert 'error:9' in abort_reason
+    assert values == []
+
+
+def test_batch_waits_for_home_after_abort(rig, tmp_path):
+    hx, grbl = rig
+    paths = []
+    for name, plan_recipe in (
+            ('abort', recipe(abort={'max_load': 20},
+                             steps=[{'type': 'move', 'z': -3, 'feed_rate': 60}])),
+            ('next', recipe(steps=[{'type': 'tare', 'times': 1, 'duration': 1,
+                                    'spacing': 1, 'pause': 1},
+                                   {'type': 'hold', 'duration': 0.2}]))):
+        path = tmp_path / f'{name}.json'
+        path.write_text(json.dumps(plan_recipe))
+        paths.append(str(path))
+
+    at_tare = []
+    tare = hx.tare
+    hx.tare = lambda **kwargs: at_tare.append((grbl.state(), grbl.position())) or tare(**kwargs)
+
+    (_, _, _, abort_reason), (_, _, values, next_reason) = run_batch(paths, hx, grbl)
+    assert abort_reason is not None
+    assert next_reason is None
+    assert at_tare == [('Idle', 0)]
+    assert values == pytest.approx([0] * 2, abs=0.01)
@@ -0,0 +1,181 @@
+from base64 import b64encode
+import gc
+from hashlib import sha1
+import json
+import logging
+import os
+import socket
+import struct
+import warnings
+
+import pytest
+
+import hx711
+from hx711 import HX711
+from recipes import compile_recipe, run_plan
+from simulation import SimulatedGrbl, SimulatedLoadCell
+from telemetry import STATES, Client, TelemetryServer, unpack_frame
+
+
+@pytest.fixture
+def server():
+    server = TelemetryServer(port=0, interval=0.01)
+    server.start()
+    yield server
+    server.stop()
+
+
+def read_response(connection):
+    '''Read an HTTP response header, returning status line and headers
+    '''
+    response = b''
+    while not response.endswith(b'\r\n\r\n'):
+        byte = connection.recv(1)
+        assert byte, 'connection closed mid-header'
+        response += byte
+    lines = response.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    return lines[0], headers
+
+
+def read_exactly(connection, size):
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        assert chunk, 'connection closed mid-frame'
+        data += chunk
+    return data
+
+
+def read_frame(connection):
+    '''Read an unmasked WebSocket frame, returning opcode and payload
+    '''
+    first, second = read_exactly(connection, 2)
+    assert not second & 0x80, 'server frames must not be masked'
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('!H', read_exactly(connection, 2))
+    elif length == 127:
+        length, = struct.unpack('!Q', read_exactly(connection, 8))
+    return first & 0x0f, read_exactly(connection, length)
+
+
+def send_handshake(connection, port, key):
+    connection.sendall(('GET /ws HTTP/1.1\r\n'
+                        f'Host: 127.0.0.1:{port}\r\n'
+                        'Upgrade: websocket\r\n'
+                        'Connection: Upgrade\r\n'
+                        f'Sec-WebSocket-Key: {key}\r\n'
+                        'Sec-WebSocket-Version: 13\r\n\r\n').encode('latin-1'))
+
+
+def test_websocket_frame(server):
+    key = b64encode(os.urandom(16)).decode('latin-1')
+    with socket.create_connection(('127.0.0.1', server.port), timeout=5) as connection:
+        send_handshake(connection, server.port, key)
+        status, headers = read_response(connection)
+        assert status.startswith('HTTP/1.1 101')
+        # computed independently, as in RFC 6455 section 1.3
+        guid = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+        expected = b64encode(sha1((key + guid).encode('latin-1')).digest()).decode('latin-1')
+        assert headers['sec-websocket-accept'] == expected
+
+        opcode, payload = read_frame(connection)
+        assert opcode == 0x1
+        assert json.loads(payload) == {'states': list(STATES), 'interval': 0.01}
+
+        server.publish(12.5, -1.25, STATES[1], sample_time=100.0)
+        opcode, payload = read_frame(connection)
+        assert opcode == 0x2
+        _, samples = unpack_frame(payload)
+        assert samples == [(100.0, 12.5, -1.25, 1)]
+
+
+def test_runs(server):
+    server.start_run('bend', specimen='A')
+    server.publish(1.0, 0.0, STATES[0])
+    server.end_run('done')
+    with socket.create_connection(('127.0.0.1', server.port), timeout=5) as connection:
+        connection.sendall(b'GET /runs HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        status, headers = read_response(connection)
+        assert status.startswith('HTTP/1.1 200')
+        assert headers['content-type'] == 'application/json'
+        runs = json.loads(read_exactly(connection, int(headers['content-length'])))
+    assert len(runs) == 1
+    assert runs[0]['name'] == 'bend'
+    assert runs[0]['specimen'] == 'A'
+    assert runs[0]['samples'] == 1
+    assert runs[0]['result'] == 'done'
+
+
+def test_client_drops_oldest():
+    client = Client(None, queue_size=2)
+    for frame in (b'1', b'2', b'3', b'4'):
+        client.offer(frame)
+    assert client.dropped == 2
+    assert [client.queue.get_nowait() for _ in range(2)] == [b'3', b'4']
+    assert client.queue.empty()
+
+
+def test_stop_with_client_connected(caplog):
+    server = TelemetryServer(port=0, interval=0.01)
+    server.start()
+    with socket.create_connection(('127.0.0.1', server.port), timeout=5) as connection, \
+            socket.create_connection(('127.0.0.1', server.port), timeout=5) as partial:
+        send_handshake(connection, server.port, b64encode(os.urandom(16)).decode('latin-1'))
+        read_response(connection)
+        read_frame(connection)
+        # request not finished when the server stops
+        partial.sendall(b'GET /runs HTTP/1.1\r\n')
+        with caplog.at_level(logging.ERROR, logger='asyncio'), \
+                warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            server.stop()
+            gc.collect()
+        # server closed both connections
+        assert connection.recv(1) == b''
+        assert partial.recv(1) == b''
+    assert [warning for warning in caught if issubclass(warning.category, ResourceWarning)] == []
+    assert caplog.records == []
+
+
+def test_run_plan_publishes(server, monkeypatch):
+    # skip HX711's start up delay
+    monkeypatch.setattr(hx711, 'sleep', lambda seconds: None)
+    grbl = SimulatedGrbl(feed_rate=60)
+    hx = HX711(5, 6, gpio=SimulatedLoadCell(grbl=grbl, contact_z=-0.1, noise=0))
+    hx.set_reading_format('MSB', 'MSB')
+    hx.set_offset(880000)
+    hx.set_reference_unit(950)
+    plan = compile_recipe({'name': 'live', 'sample_rate': 20,
+                           'steps': [{'type': 'settle', 'duration': 0.1},
+                                     {'type': 'move', 'z': -0.2, 'feed_rate': 60},
+                                     {'type': 'hold', 'duration': 0.2}]},
+                          feed_rate=60)
+
+    samples = []
+    with socket.create_connection(('127.0.0.1', server.port), timeout=5) as connection:
+        send_handshake(connection, server.port, b64encode(os.urandom(16)).decode('latin-1'))
+        read_response(connection)
+        read_frame(connection)
+        _, _, values, abort_reason = run_plan(plan, hx, grbl, telemetry=server)
+        while not samples or samples[-1][3] != STATES.index('done'):
+            opcode, payload = read_frame(connection)
+            samples.extend(unpack_frame(payload)[1])
+
+    assert abort_reason is None
+    states = [STATES[sample[3]] for sample in samples]
+    assert states == ['settle', 'move'] + ['move'] * 4 + ['hold'] + ['hold'] * 4 + ['done']
+    # step starts are published with the last value, NaN before the first sample
+    assert samples[0][1] != samples[0][1]
+    assert [sample[1] for sample in samples if STATES[sample[3]] == 'hold'][1:] == \
+        pytest.approx(values[4:], abs=1e-3)
+    assert samples[-1][2] == pytest.approx(-0.2)
+    run, = server.runs
+    assert run['name'] == 'live'
+    assert run['result'] == 'done'
+    assert run['planned_samples'] == len(values) == 8